@@ -0,0 +1,186 @@
+"""
+test.py 的基准测试 (文件名不以 test_ 开头, 不会被 pytest 收集)。
+
+    python gacha_bench.py run [--output PATH] [--quick]
+        运行全部用例, 打印结果并保存为 JSON 基线
+    python gacha_bench.py compare BASELINE [CURRENT] [--threshold 0.2]
+        与基线比较 (未给出 CURRENT 时现场运行), 任一耗时增加超过阈值或模拟均值明显偏离解析均值时以状态码 1 退出
+
+用例: 启动开销 (解释器 + import test + 实例化 MODEL_LOGIC; 另用 python -X importtime 检查 import test 本身
+不超过 IMPORT_TARGET_S 且不导入 NumPy), 以及每个卡池、targetCount 1/3/7 的
+MathematicalModel 与 MonteCarloModel。每个用例在独立子进程中运行并禁用磁盘缓存, 因此 cold 包含求解转移链的时间,
+warm 为同一进程中的再次运行。
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_OUTPUT = os.path.join(HERE, '..', 'data', 'gacha', 'benchmark.json')
+TARGET_COUNTS = (1, 3, 7)
+INITIAL_STATE = {"pity": 0, "isGuaranteed": False, "mingguangCounter": 0, "fatePoint": 0}
+STARTUP_REPEATS = 5
+WARM_REPEATS = 20 # 解析模型单次耗时只有微秒级, 取多次中的最小值
+MAX_Z = 4.0 # 模拟均值与解析均值之差超过 MAX_Z 个标准误即视为不一致
+NOISE_SECONDS = 1e-3 # 比较时忽略小于该值的绝对差异
+# import test 的目标耗时 (importtime 累计值)。NumPy 与各卡池的概率表都延迟到第一次计算时才加载,
+# 命中结果缓存的期望计算请求只需要这部分开销
+IMPORT_TARGET_S = 0.05
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError: # Windows 没有 resource 模块
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == 'darwin' else rss / 2**10 # macOS 以字节为单位, Linux 以 KB 为单位
+
+def _timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+def run_case(case):
+    """在当前 (全新的) 进程中运行一个用例, 返回测量结果"""
+    if case['kind'] == 'startup':
+        import_s, test = _timed(lambda: __import__('test'))
+        instantiate_s, _ = _timed(lambda: list(test.MODEL_LOGIC.values()))
+        return {"import_s": import_s, "instantiate_s": instantiate_s, "peak_rss_mb": _peak_rss_mb()}
+
+    import test
+    import numpy as np # type: ignore
+    game, pool = case['pool'].split('-')
+    args = {"game": game, "pool": pool, "initialState": dict(INITIAL_STATE), "targetCount": case['targetCount'],
+            "up4C6": False, "seed": 1, "workers": 1, "cache": False}
+
+    if case['kind'] == 'math':
+        cold_s, result = _timed(lambda: test.MathematicalModel(args).run())
+        warm_s = min(_timed(lambda: test.MathematicalModel(args).run())[0] for _ in range(WARM_REPEATS))
+        return {"cold_s": cold_s, "warm_s": warm_s, "mean": result['mean'], "peak_rss_mb": _peak_rss_mb()}
+
+    def simulate():
+        mc = test.MonteCarloModel(args)
+        if case.get('simulationCount'): mc.simulation_count = case['simulationCount']
+        return mc.simulate()
+
+    cold_s, (aggregate, _) = _timed(simulate)
+    warm_s, _ = _timed(simulate)
+    hist = aggregate.pulls[-1]
+    values = np.arange(len(hist.counts))
+    mean = hist.mean()
+    variance = float(values ** 2 @ hist.counts) / hist.n - mean ** 2
+    analytic = test.MathematicalModel(args).run()['mean']
+    total_pulls = int(values @ hist.counts)
+    return {
+        "cold_s": cold_s, "warm_s": warm_s, "samples": hist.n, "pulls_per_s": total_pulls / warm_s,
+        "mean": mean, "analytic_mean": analytic, "z": (mean - analytic) / max((variance / hist.n) ** 0.5, 1e-12),
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+def _run_in_subprocess(case):
+    env = dict(os.environ, GACHA_CACHE_DIR='')
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), '_case', json.dumps(case)],
+                         cwd=HERE, env=env, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout)
+
+def _importtime():
+    """用 python -X importtime 测量 import test 的累计耗时 (秒), 并返回其间是否导入了 NumPy"""
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import test'], cwd=HERE, capture_output=True, text=True, check=True)
+    cumulative = {}
+    for line in out.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[1].strip().isdigit(): cumulative[fields[2].strip()] = int(fields[1]) / 1e6
+    return cumulative['test'], 'numpy' in cumulative
+
+def _startup_case():
+    walls, runs = [], []
+    for _ in range(STARTUP_REPEATS):
+        wall_s, result = _timed(lambda: _run_in_subprocess({"kind": "startup"}))
+        walls.append(wall_s); runs.append(result)
+    best = min(range(STARTUP_REPEATS), key=lambda i: walls[i])
+    importtimes = [_importtime() for _ in range(STARTUP_REPEATS)]
+    return dict(runs[best], wall_s=walls[best], importtime_s=min(t for t, _ in importtimes),
+                numpy_at_import=any(n for _, n in importtimes))
+
+def run_all(quick=False):
+    sys.path.insert(0, HERE)
+    from test import POOL_SPECS
+    results = {"startup": _startup_case()}
+    for pool in POOL_SPECS:
+        for count in TARGET_COUNTS:
+            for kind in ('math', 'mc'):
+                case = {"kind": kind, "pool": pool, "targetCount": count, "simulationCount": 5000 if quick else None}
+                name = f"{kind}/{pool}/k{count}"
+                results[name] = _run_in_subprocess(case)
+                _print_row(name, results[name])
+    _print_row('startup', results['startup'])
+    print(f"import test (-X importtime): {results['startup']['importtime_s'] * 1000:.1f}ms (target {IMPORT_TARGET_S * 1000:.0f}ms), "
+          f"numpy imported: {results['startup']['numpy_at_import']}")
+    return {"python": sys.version.split()[0], "quick": quick, "created": time.strftime('%Y-%m-%d %H:%M:%S'), "cases": results}
+
+def _fmt(value, spec):
+    return format(value, spec) if value is not None else '-'
+
+def _print_row(name, r):
+    print(f"{name:34s} cold {_fmt(r.get('cold_s', r.get('wall_s')), '9.4f')}s  warm {_fmt(r.get('warm_s', r.get('import_s')), '9.5f')}s  "
+          f"pulls/s {_fmt(r.get('pulls_per_s'), '12,.0f')}  rss {_fmt(r.get('peak_rss_mb'), '7.1f')}MB  z {_fmt(r.get('z'), '6.2f')}", flush=True)
+
+def compare(baseline, current, threshold):
+    """返回问题列表: 耗时增加超过 threshold (相对值) 的指标, 以及模拟均值偏离解析均值的用例"""
+    problems = []
+    startup = current['cases'].get('startup', {})
+    if startup.get('importtime_s', 0) > IMPORT_TARGET_S or startup.get('numpy_at_import'):
+        problems.append(f"startup: import test took {startup['importtime_s'] * 1000:.1f}ms (target {IMPORT_TARGET_S * 1000:.0f}ms), "
+                        f"numpy imported: {startup['numpy_at_import']}")
+    for name, cur in current['cases'].items():
+        if cur.get('z') is not None and abs(cur['z']) > MAX_Z:
+            problems.append(f"{name}: simulated mean {cur['mean']:.3f} vs analytic {cur['analytic_mean']:.3f} (z={cur['z']:.2f})")
+        base = baseline['cases'].get(name)
+        if base is None: continue
+        for metric in ('wall_s', 'import_s', 'instantiate_s', 'importtime_s', 'cold_s', 'warm_s'):
+            if metric not in cur or metric not in base: continue
+            if cur[metric] > base[metric] * (1 + threshold) and cur[metric] - base[metric] > NOISE_SECONDS:
+                problems.append(f"{name}: {metric} {base[metric]:.4f}s -> {cur[metric]:.4f}s (+{cur[metric] / base[metric] - 1:.0%})")
+    return problems
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+    run_p = sub.add_parser('run')
+    run_p.add_argument('--output', default=DEFAULT_OUTPUT)
+    run_p.add_argument('--quick', action='store_true', help='每个模拟用例只模拟 5000 次')
+    cmp_p = sub.add_parser('compare')
+    cmp_p.add_argument('baseline')
+    cmp_p.add_argument('current', nargs='?')
+    cmp_p.add_argument('--threshold', type=float, default=0.2)
+    cmp_p.add_argument('--quick', action='store_true')
+    case_p = sub.add_parser('_case') # 内部使用: 在子进程中运行单个用例
+    case_p.add_argument('case')
+    opts = parser.parse_args(argv)
+
+    if opts.command == '_case':
+        sys.path.insert(0, HERE)
+        print(json.dumps(run_case(json.loads(opts.case))))
+        return 0
+    if opts.command == 'run':
+        report = run_all(opts.quick)
+        os.makedirs(os.path.dirname(os.path.abspath(opts.output)), exist_ok=True)
+        with open(opts.output, 'w', encoding='utf-8') as f: json.dump(report, f, indent=2)
+        print(f"saved {opts.output}")
+        return 0
+
+    with open(opts.baseline, encoding='utf-8') as f: baseline = json.load(f)
+    if opts.current:
+        with open(opts.current, encoding='utf-8') as f: current = json.load(f)
+    else:
+        current = run_all(opts.quick or baseline.get('quick', False))
+    problems = compare(baseline, current, opts.threshold)
+    for problem in problems: print(f"REGRESSION {problem}")
+    print(f"{len(problems)} regression(s) at threshold {opts.threshold:.0%}")
+    return 1 if problems else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,515 +1,1335 @@
+import time
+_IMPORT_STARTED = time.perf_counter() # 用于 profile 报告模块导入 (主要是 NumPy) 的耗时
+import os
 import sys
 import json
-import numpy as np # type: ignore
+import math
+import hashlib
+import glob
+import itertools
+import functools
+import contextlib
+import collections
+import collections.abc
+import threading
+
+def _import_numpy():
+    """
+    首次用到 NumPy 时才导入, 并用真正的模块替换下面的代理 np。命中结果缓存的请求不需要任何计算,
+    因此不必付出占启动时间大半的 NumPy 导入开销。
+    """
+    global np, NUMPY_IMPORT_SECONDS
+    if isinstance(np, _LazyNumpy):
+        started = time.perf_counter()
+        import numpy # type: ignore
+        np, NUMPY_IMPORT_SECONDS = numpy, time.perf_counter() - started
+    return np
+
+class _LazyNumpy:
+    def __getattr__(self, name): return getattr(_import_numpy(), name)
+
+np, NUMPY_IMPORT_SECONDS = _LazyNumpy(), 0.0
+
+# 已求解表的磁盘缓存 (每个表一个 .npy 文件, 以内存映射方式加载); 环境变量设为空字符串可禁用
+TABLE_CACHE_DIR = os.environ.get('GACHA_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'gacha'))
+TABLE_CACHE_VERSION = 2 # 修改转移链的构建方式时递增, 使旧缓存失效
+# 请求结果缓存: 磁盘层位于表缓存目录下的 results/, 总大小上限 (MB) 可由环境变量调整
+RESULT_CACHE_MAX_BYTES = int(float(os.environ.get('GACHA_RESULT_CACHE_MB', 64)) * 2**20)
+
+class RequestProfile:
+    """
+    args['profile'] 为真时收集的各阶段耗时 (秒) 与计数器。通过线程局部变量传给当前线程中的各模型,
+    未启用时 phase() 不做任何记录。同名阶段嵌套时只计最外层。
+    """
+    _local = threading.local()
+
+    def __init__(self):
+        self.timings, self.counters, self._open = collections.defaultdict(float), collections.Counter(), set()
+
+    @classmethod
+    def current(cls): return getattr(cls._local, 'profile', None)
+
+    @contextlib.contextmanager
+    def active(self):
+        self._local.profile = self
+        try:
+            yield self
+        finally:
+            self._local.profile = None
+
+    @classmethod
+    @contextlib.contextmanager
+    def phase(cls, name):
+        profile = cls.current()
+        if profile is None or name in profile._open:
+            yield; return
+        profile._open.add(name); started = time.perf_counter()
+        try:
+            yield
+        finally:
+            profile._open.discard(name); profile.timings[name] += time.perf_counter() - started
+
+class RequestStream:
+    """
+    请求的进度输出与取消, 与 RequestProfile 一样通过线程局部变量传给当前线程中的各模型。
+    模拟每完成一个分块就把当前的部分结果交给 emit (为 None 时不输出); cancelled 被设置后不再追加分块,
+    直接用已完成的分块给出结果, 此时 interrupted 为真, 结果带有 "cancelled": true 且不写入结果缓存。
+    """
+    _local = threading.local()
+
+    def __init__(self, emit=None):
+        self.emit, self.cancelled, self.interrupted = emit, threading.Event(), False
+
+    @classmethod
+    def current(cls): return getattr(cls._local, 'stream', None)
+
+    @contextlib.contextmanager
+    def active(self):
+        self._local.stream = self
+        try:
+            yield self
+        finally:
+            self._local.stream = None
+
+class IntHistogram:
+    """
+    整数样本的精确直方图 (counts[v] 为取值 v 的样本数)。内存只与取值范围有关而与样本数无关,
+    来自不同分块或进程的直方图可直接相加合并。分位数与 np.percentile 默认的线性插值一致。
+    """
+    def __init__(self, counts=None):
+        self.counts = np.zeros(1, dtype=np.int64) if counts is None else counts
+        self._cumulative = None
+
+    @classmethod
+    def of(cls, values):
+        # 抽数与各卡池的返还 (星辉/星芒) 都是非负整数, 返还数组虽为浮点也可无损取整
+        return cls(np.bincount(np.rint(values).astype(np.int64), minlength=1))
+
+    def merge(self, other):
+        big, small = (self.counts, other.counts) if len(self.counts) >= len(other.counts) else (other.counts, self.counts)
+        merged = big.copy(); merged[:len(small)] += small
+        return IntHistogram(merged)
+
+    @property
+    def n(self): return int(self.cumulative()[-1])
+
+    def cumulative(self):
+        if self._cumulative is None: self._cumulative = np.cumsum(self.counts)
+        return self._cumulative
+
+    def mean(self): return float(np.arange(len(self.counts)) @ self.counts) / self.n
+    def value_at(self, rank): return int(np.searchsorted(self.cumulative(), rank, side='right')) # 第 rank 小 (从 0 开始) 的样本
+    def cdf(self): return self.cumulative() / self.n
+
+    def percentile(self, q):
+        h = (self.n - 1) * q / 100; lo = int(np.floor(h))
+        x_lo, x_hi = self.value_at(lo), self.value_at(min(lo + 1, self.n - 1))
+        return x_lo + (h - lo) * (x_hi - x_lo)
+
+    def fraction_at_most(self, x):
+        if x < 0: return 0.0
+        return float(self.cumulative()[min(int(x), len(self.counts) - 1)]) / self.n
+
+class SimulationAggregate:
+    """
+    模拟结果的流式汇总: 每个目标列各保存一个抽数直方图和一个返还直方图, 分块之间逐个合并。
+    stats 为随分块一起合并的计数 (各分块的模拟/汇总耗时、随机数用量), 子进程中的分块也能带回主进程。
+    """
+    def __init__(self, pulls, returns, samples, stats=None):
+        self.pulls, self.returns, self.samples = pulls, returns, samples
+        self.stats = collections.Counter() if stats is None else stats
+
+    @classmethod
+    def from_chunk(cls, pulls, returns, stats=None):
+        pulls, returns = pulls.reshape(len(pulls), -1), returns.reshape(len(returns), -1)
+        return cls([IntHistogram.of(c) for c in pulls.T], [IntHistogram.of(c) for c in returns.T], len(pulls), stats)
+
+    def merge(self, other):
+        return SimulationAggregate([a.merge(b) for a, b in zip(self.pulls, other.pulls)],
+                                   [a.merge(b) for a, b in zip(self.returns, other.returns)],
+                                   self.samples + other.samples, self.stats + other.stats)
+
+    def column(self, per_target, k):
+        """per_target (self.pulls 或 self.returns) 中第 k 个目标的直方图; k 为 0 时所有样本都是 0"""
+        return per_target[k - 1] if k > 0 else IntHistogram(np.array([self.samples]))
+
+    def final(self, per_target): return self.column(per_target, len(per_target))
+
+def _simulate_chunk_task(args, n, seed_seq):
+    """进程池任务: 在子进程中模拟一个分块, 只把汇总后的直方图传回主进程"""
+    return MonteCarloModel(args).aggregate_chunk(n, seed_seq)
 
 class MonteCarloModel:
+    # 模拟按固定大小分块, 第 i 块使用 SeedSequence(seed).spawn 派生的第 i 个随机流,
+    # 因此同一个 seed 的结果与 workers 数量无关
+    CHUNK_RUNS = 10_000
+    # 自适应模式: 置信水平 95%, 默认的区间半宽要求 (抽数 / 成功率百分点) 与模拟次数上限
+    CI_Z, DEFAULT_TOLERANCE, DEFAULT_RATE_TOLERANCE, MAX_ADAPTIVE_RUNS = 1.96, 1.0, 0.5, 1_000_000
+
     def __init__(self, args):
-        self.args = args
+        # 与期望/精确模式一致, targetCount 为负时按 0 个目标处理
+        self.args = dict(args, targetCount=max(int(args['targetCount']), 0))
         self.simulation_count = 50000 if args['pool'] == 'character' else 25000
+        self.workers = max(1, int(args.get('workers') or 1))
+        self.adaptive = bool(args.get('adaptive', False))
     
     def run(self):
-        rng = self._RNG()
-        model_key = f"{self.args['game']}-{self.args['pool']}"
-        model_logic = MODEL_LOGIC[model_key]
+        aggregate, seed = self.simulate()
+        pulls_hist = aggregate.pulls[-1]
+
+        with RequestProfile.phase('aggregation'):
+            return self._summarize(aggregate, pulls_hist, seed)
+
+    def _summarize(self, aggregate, pulls_hist, seed):
+        pulls_data = self._calculate_percentiles(pulls_hist)
+        result = {"pulls": pulls_data, "samples": aggregate.samples}
+        
+        # 如果提供了预算，计算成功率
+        if self.args.get('budget') is not None:
+            result['success_rate'] = pulls_hist.fraction_at_most(self.args['budget']) * 100
+
+        # 自适应模式下在各分位数旁给出置信区间半宽
+        if self.adaptive:
+            for key, half_width in self._half_widths(pulls_hist).items():
+                if key == 'success_rate': result['success_rate_hw'] = half_width
+                else: pulls_data[f"{key}_hw"] = half_width
+
+        # 只有角色池有详细的返还物计算
+        if self.args['pool'] == 'character':
+            result["returns"] = self._calculate_percentiles(aggregate.final(aggregate.returns), is_float=True)
+
+        if self.args.get('jit'): result["jit"] = _jit_kernel() is not None
+        result["seed"] = seed
+        return result
+
+    def simulate(self):
+        """
+        按分块完成模拟, 返回 (SimulationAggregate, 实际使用的 seed)。每个分块模拟完立即汇总进直方图, 内存不随样本数增长。
+        自适应模式下持续追加分块, 直到 p50/p90/p95 与成功率的置信区间足够窄、超过 deadline 秒或达到模拟次数上限。
+        当前线程有 RequestStream 时每块之后输出部分结果, 请求被取消后提前结束 (至少完成一个分块)。
+        """
+        seed_seq = np.random.SeedSequence(self.args.get('seed'))
+        stream = RequestStream.current()
+        started = time.monotonic()
+        aggregate, merge_s = None, 0.0
+        for chunk in self._iter_chunks(seed_seq):
+            merge_started = time.perf_counter()
+            aggregate = chunk if aggregate is None else aggregate.merge(chunk)
+            merge_s += time.perf_counter() - merge_started
+            if stream is not None and stream.emit is not None:
+                stream.emit(self._summarize(aggregate, aggregate.final(aggregate.pulls), seed_seq.entropy))
+            if stream is not None and stream.cancelled.is_set():
+                stream.interrupted = True; break
+            # 逐块按顺序判断是否停止, 并行时多算的分块直接丢弃, 保证结果与 workers 数量无关
+            if self.adaptive and self._should_stop(aggregate, started): break
+        self._record_profile(aggregate, merge_s)
+        return aggregate, seed_seq.entropy
+
+    def _record_profile(self, aggregate, merge_s):
+        """把各分块带回的耗时与计数计入当前请求的 profile (并行时耗时为各进程之和)"""
+        profile = RequestProfile.current()
+        if profile is None: return
+        stats = aggregate.stats
+        profile.timings['simulation'] += stats['simulation_s']
+        profile.timings['aggregation'] += stats['aggregation_s'] + merge_s
+        if aggregate.pulls:
+            hist = aggregate.pulls[-1]
+            profile.counters['pulls_simulated'] += int(np.arange(len(hist.counts)) @ hist.counts)
+        for key in ('rng_draws', 'rng_refills'):
+            if key in stats: profile.counters[key] += stats[key]
+
+    def _iter_chunks(self, seed_seq):
+        if self.adaptive:
+            sizes = itertools.repeat(self.CHUNK_RUNS)
+        else:
+            n_chunks = -(-self.simulation_count // self.CHUNK_RUNS)
+            sizes = iter([min(self.CHUNK_RUNS, self.simulation_count - i * self.CHUNK_RUNS) for i in range(n_chunks)])
+
+        if self.workers == 1:
+            for n in sizes: yield self.aggregate_chunk(n, seed_seq.spawn(1)[0])
+            return
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                batch = list(itertools.islice(sizes, self.workers))
+                if not batch: return
+                yield from executor.map(_simulate_chunk_task, [self.args] * len(batch), batch, seed_seq.spawn(len(batch)))
+
+    def _should_stop(self, aggregate, started):
+        deadline = self.args.get('deadline')
+        if deadline is not None and time.monotonic() - started >= deadline: return True
+        if aggregate.samples >= self.args.get('maxSimulations', self.MAX_ADAPTIVE_RUNS): return True
+        half_widths = self._half_widths(aggregate.final(aggregate.pulls))
+        rate_hw = half_widths.pop('success_rate', 0.0)
+        return (max(half_widths.values()) <= self.args.get('tolerance', self.DEFAULT_TOLERANCE)
+                and rate_hw <= self.args.get('rateTolerance', self.DEFAULT_RATE_TOLERANCE))
+
+    def _half_widths(self, pulls_hist):
+        """
+        分位数用顺序统计量给出无分布假设的置信区间, 成功率用 Wilson 区间 (观测值为 0% 或 100% 时正态近似的区间宽度为 0,
+        会在第一个分块后就误判为已收敛); 返回各项的区间半宽
+        """
+        n = pulls_hist.n; half_widths = {}
+        for q in (50, 90, 95):
+            p = q / 100; d = self.CI_Z * np.sqrt(n * p * (1 - p))
+            lo = pulls_hist.value_at(max(int(np.floor(n * p - d)), 0))
+            hi = pulls_hist.value_at(min(int(np.ceil(n * p + d)), n - 1))
+            half_widths[f"p{q}"] = float(hi - lo) / 2
+        if self.args.get('budget') is not None:
+            rate, z2 = pulls_hist.fraction_at_most(self.args['budget']), self.CI_Z ** 2
+            half_width = self.CI_Z * np.sqrt(rate * (1 - rate) / n + z2 / (4 * n * n)) / (1 + z2 / n)
+            half_widths['success_rate'] = float(half_width) * 100
+        return half_widths
+
+    def aggregate_chunk(self, n, seed_seq):
+        stats = collections.Counter()
+        started = time.perf_counter()
+        pulls, returns = self.simulate_chunk(n, seed_seq, stats)
+        simulated = time.perf_counter()
+        aggregate = SimulationAggregate.from_chunk(pulls, returns, stats)
+        stats['simulation_s'] += simulated - started
+        stats['aggregation_s'] += time.perf_counter() - simulated
+        return aggregate
+
+    def simulate_chunk(self, n, seed_seq, stats=None):
+        """
+        模拟一个分块。两种引擎都记录获得每个目标时的累计抽数与累计返还 (形状 n×targetCount);
+        args['perTarget'] 为真时原样返回 (供多场景批量计算使用), 否则只返回最终总量。
+        给出 stats (Counter) 时在其中累加取用的随机数个数 rng_draws 与逐次模拟的随机数块补充次数 rng_refills。
+        """
+        model_logic = MODEL_LOGIC[f"{self.args['game']}-{self.args['pool']}"]
+        rng = self._CountingGenerator(np.random.default_rng(seed_seq))
+        stats = collections.Counter() if stats is None else stats
+        # 默认使用锁步向量化引擎, engine='scalar' 可切回逐次模拟的原始实现
+        if self.args.get('engine', 'vectorized') == 'scalar':
+            pulls, returns = self._simulate_scalar(model_logic, n, rng, stats)
+        else:
+            pulls, returns = self._simulate_batch(model_logic, n, rng)
+            stats['rng_draws'] += rng.drawn
+        if self.args.get('perTarget'): return pulls, returns
+        if pulls.shape[1] == 0: return np.zeros(n, dtype=np.int64), np.zeros(n)
+        return pulls[:, -1], returns[:, -1]
 
+    def _simulate_scalar(self, model_logic, n, generator, stats):
+        # args['jit'] 为真且安装了 Numba 时使用 JIT 内核。内核的随机数流 (以分块的随机流为种子的 MT19937) 与纯 Python 实现不同,
+        # 默认关闭, 使同一种子的结果不取决于是否安装了 Numba; 结果中的 jit 字段表示实际使用的路径
+        kernel = _jit_kernel() if self.args.get('jit', False) else None
+        if kernel is not None:
+            pulls, returns, draws = model_logic.simulate_full_runs(kernel, n, self.args, int(generator.integers(2**32)))
+            stats['rng_draws'] += draws
+            return pulls, returns
+        rng = self._RNG(generator)
         pulls_results, returns_results = [], []
         
         # 主模拟循环
-        for _ in range(self.simulation_count):
+        for _ in range(n):
             pulls, returns = self._simulate_one_full_run(rng, model_logic)
             pulls_results.append(pulls)
-            # 只有角色池有详细的返还物计算
-            if self.args['pool'] == 'character':
-                returns_results.append(returns)
-        
-        pulls_array = np.array(pulls_results)
-        pulls_data = self._calculate_percentiles(pulls_array)
-        result = {"pulls": pulls_data}
-        
-        # 如果提供了预算，计算成功率
-        if self.args.get('budget') is not None:
-            budget = self.args['budget']
-            success_count = np.sum(pulls_array <= budget)
-            result['success_rate'] = (success_count / self.simulation_count) * 100
+            returns_results.append(returns)
+        stats['rng_draws'] += rng.refills * rng.CHUNK_SIZE + rng.index
+        stats['rng_refills'] += rng.refills
+        return np.array(pulls_results, dtype=np.int64).reshape(n, -1), np.array(returns_results, dtype=float).reshape(n, -1)
 
-        # 如果计算了返还物，则加入结果
-        if returns_results:
-            result["returns"] = self._calculate_percentiles(np.array(returns_results), is_float=True)
-            
-        return result
+    def _simulate_batch(self, model_logic, n, rng):
+        """
+        锁步向量化模拟: n 次模拟的状态保存在 NumPy 数组中, 每一步所有未完成的模拟同时前进一抽。
+        已完成的模拟被掩码屏蔽, 当过半模拟完成时压缩数组, 避免在已结束的模拟上浪费计算。
+        """
+        init = self.args['initialState']
+        state = {
+            'pity': np.full(n, init['pity'], dtype=np.int32),
+            'pity4': np.zeros(n, dtype=np.int32),
+            'isGuaranteed4': np.zeros(n, dtype=bool),
+            'layer': np.full(n, model_logic.layer_of(init), dtype=np.intp),
+        }
+        collection = model_logic.new_batch_collection(n)
+        up4_c6 = self.args.get('up4C6', False)
+
+        target_count = self.args['targetCount']
+        # 获得第 k 个目标时的累计抽数与累计返还
+        out_pulls, out_returns = np.zeros((n, target_count), dtype=np.int64), np.zeros((n, target_count))
+        ids = np.arange(n) # 压缩后数组位置 -> 模拟编号
+        pulls, returns = np.zeros(n, dtype=np.int64), np.zeros(n)
+        remaining = np.full(n, target_count, dtype=np.int32)
+        active = remaining > 0
+
+        while active.any():
+            step_returns, won = model_logic.batch_pull_step(state, active, rng, collection, up4_c6)
+            pulls += active
+            returns += step_returns
+            remaining -= won
+            if won.any():
+                rows = np.flatnonzero(won); k = target_count - remaining[rows] - 1
+                out_pulls[ids[rows], k], out_returns[ids[rows], k] = pulls[rows], returns[rows]
+            active = remaining > 0
+            n_active = np.count_nonzero(active)
+            if n_active * 2 > active.size or n_active == 0: continue
+
+            ids, pulls, returns, remaining = ids[active], pulls[active], returns[active], remaining[active]
+            state = {k: v[active] for k, v in state.items()}
+            collection = collection[active]
+            active = np.ones(n_active, dtype=bool)
+
+        return out_pulls, out_returns
 
-    def _calculate_percentiles(self, data, is_float=False):
+    @staticmethod
+    def _calculate_percentiles(hist, is_float=False):
         dtype = float if is_float else int
         return {
-            "mean": np.mean(data),
-            "p25": dtype(np.percentile(data, 25)),
-            "p50": dtype(np.percentile(data, 50)),
-            "p75": dtype(np.percentile(data, 75)),
-            "p90": dtype(np.percentile(data, 90)),
-            "p95": dtype(np.percentile(data, 95))
+            "mean": hist.mean(),
+            "p25": dtype(hist.percentile(25)),
+            "p50": dtype(hist.percentile(50)),
+            "p75": dtype(hist.percentile(75)),
+            "p90": dtype(hist.percentile(90)),
+            "p95": dtype(hist.percentile(95))
         }
 
     def _simulate_one_full_run(self, rng, model_logic):
         total_pulls, total_returns = 0, 0
-        # 复制初始状态，避免在多次模拟中被污染
-        state = self.args['initialState'].copy()
-        state['pity4'] = 0
-        state['isGuaranteed4'] = False
+        cumulative_pulls, cumulative_returns = [], []
+        # 由初始状态构造本次模拟的状态，避免在多次模拟中被污染
+        init = self.args['initialState']
+        state = {'pity': init['pity'], 'pity4': 0, 'isGuaranteed4': False, 'layer': model_logic.layer_of(init)}
         
         # 'collection' 用于追踪获取到的角色/武器，以计算返还
-        collection = {'up_5_star': 0}
+        collection = model_logic.new_collection()
 
         # 循环获取目标
         for _ in range(self.args['targetCount']):
             pulls, returns = model_logic.get_one_target_pulls_sim(state, rng, collection, self.args.get('up4C6', False))
             total_pulls += pulls
             total_returns += returns
+            cumulative_pulls.append(total_pulls); cumulative_returns.append(total_returns)
             
-        return total_pulls, total_returns
+        return cumulative_pulls, cumulative_returns
 
     class _RNG:
         """一个预生成随机数的快速RNG，避免在循环中频繁调用np.random"""
         CHUNK_SIZE = 1_000_000
-        def __init__(self): self.chunk=np.random.rand(self.CHUNK_SIZE); self.index=0
+        def __init__(self, gen): self.gen=gen; self.chunk=gen.random(self.CHUNK_SIZE); self.index=0; self.refills=0
         def get(self):
-            if self.index >= self.CHUNK_SIZE: self.chunk=np.random.rand(self.CHUNK_SIZE); self.index=0
+            if self.index >= self.CHUNK_SIZE: self.chunk=self.gen.random(self.CHUNK_SIZE); self.index=0; self.refills+=1
             num=self.chunk[self.index]; self.index+=1; return num
 
+    class _CountingGenerator:
+        """包装 np.random.Generator, 统计 random() 取用的随机数个数, 其余方法直接转发"""
+        def __init__(self, gen): self.gen, self.drawn = gen, 0
+        def random(self, size=None):
+            self.drawn += 1 if size is None else int(np.prod(size))
+            return self.gen.random(size)
+        def __getattr__(self, name): return getattr(self.gen, name)
+
 class MathematicalModel:
     def __init__(self, args):
         self.args = args
         self.model_logic = MODEL_LOGIC[f"{args['game']}-{args['pool']}"]
 
     def run(self):
-        # 注意: 只有原神角色池有复杂的`get_total_expectation`实现
-        # 其他模型使用简化计算
-        if hasattr(self.model_logic, 'get_total_expectation'):
-            mean = self.model_logic.get_total_expectation(self.args)
-        else:
-            # 简化计算：第一个的期望 + (n-1) * 后续的期望
-            initial_pulls = self.model_logic.get_expectation_for_state(self.args['initialState'])
-            subsequent_pulls = self.model_logic.get_subsequent_expectation()
-            mean = initial_pulls + (self.args['targetCount'] - 1) * subsequent_pulls
-        return {"mean": mean}
+        # 方差、标准差与偏度由总抽数的前三阶原点矩得到, 与均值一样无需抽样
+        m1, m2, m3 = self.model_logic.get_total_moments(self.args)
+        variance = max(m2 - m1 ** 2, 0.0)
+        third_central = m3 - 3 * m1 * m2 + 2 * m1 ** 3
+        return {
+            "mean": self.model_logic.get_total_expectation(self.args),
+            "variance": variance, "std": math.sqrt(variance),
+            "skewness": third_central / variance ** 1.5 if variance > 0 else 0.0,
+        }
+
+class ExactDistributionModel:
+    """精确分布模式: 总抽数的分位数与预算成功率由吸收链精确计算, 只有返还物统计仍使用蒙特卡洛模拟"""
+    def __init__(self, args):
+        self.args = args
+        self.model_logic = MODEL_LOGIC[f"{args['game']}-{args['pool']}"]
+
+    def run(self):
+        pmf = self.model_logic.get_pull_distribution(self.args['initialState'], self.args['targetCount'])
+        cdf = np.cumsum(pmf)
+        result = {"pulls": self._calculate_percentiles(pmf, cdf), "pmf": pmf.tolist(), "cdf": cdf.tolist()}
+
+        if self.args.get('budget') is not None:
+            result['success_rate'] = self._success_rate(cdf, self.args['budget'])
+
+        if self.args['pool'] == 'character':
+            mc = MonteCarloModel(self.args)
+            aggregate, result["seed"] = mc.simulate()
+            result["returns"] = mc._calculate_percentiles(aggregate.returns[-1], is_float=True)
+        return result
+
+    @staticmethod
+    def _calculate_percentiles(pmf, cdf):
+        # 分位数取累计概率首次达到该水平的抽数
+        quantile = lambda q: int(np.searchsorted(cdf, q / 100 - 1e-12))
+        return {
+            "mean": float(np.arange(len(pmf)) @ pmf),
+            "p25": quantile(25), "p50": quantile(50), "p75": quantile(75),
+            "p90": quantile(90), "p95": quantile(95)
+        }
+
+    @staticmethod
+    def _success_rate(cdf, budget):
+        # 预算内达成的概率 (百分数); 超出 CDF 长度的预算取最后一项 (CDF 已截断尾部的平台)
+        return float(cdf[min(max(int(budget), 0), len(cdf) - 1)]) * 100
+
+class ScenarioModel:
+    """
+    多场景批量计算: 同一 game/pool/initialState 下的多个 {targetCount, budget} 场景共用一次计算。
+    精确模式只传播一次概率向量, 模拟模式只按最大 targetCount 模拟一次并记录每个目标的累计抽数;
+    每个场景都给出完整的 预算 -> 成功率 曲线 (success_curve[b] 为 b 抽内达成的概率, 百分比)。
+    期望模式给出解析的均值与矩; 只要有场景带 budget, 就另外传播一次精确分布给出分位数、曲线与成功率 (不模拟返还物),
+    否则不含 success_curve。
+    """
+    def __init__(self, args):
+        self.args = args
+        self.scenarios = args['scenarios']
+        self.max_targets = max(int(s['targetCount']) for s in self.scenarios)
+
+    def run(self):
+        mode = self.args.get('mode', 'expectation')
+        if mode == 'exact': return self._run_exact()
+        if mode == 'distribution': return self._run_simulation()
+        answers = [dict(s, **MathematicalModel(dict(self.args, targetCount=s['targetCount'])).run()) for s in self.scenarios]
+        if any(s.get('budget') is not None for s in self.scenarios):
+            for answer, exact in zip(answers, self._run_exact(with_returns=False)['scenarios']):
+                answer.update({k: exact[k] for k in ('pulls', 'success_curve', 'success_rate') if k in exact})
+        return {"scenarios": answers}
+
+    def _run_exact(self, with_returns=True):
+        exact = ExactDistributionModel(self.args)
+        pmfs = exact.model_logic.get_pull_distributions(self.args['initialState'], self.max_targets) if self.max_targets > 0 else []
+        aggregate, result = None, {}
+        if with_returns and self.args['pool'] == 'character':
+            aggregate, result["seed"] = MonteCarloModel(dict(self.args, targetCount=self.max_targets, perTarget=True)).simulate()
+
+        answers = []
+        for s in self.scenarios:
+            k = int(s['targetCount'])
+            pmf = pmfs[k - 1] if k > 0 else np.ones(1)
+            cdf = np.cumsum(pmf)
+            # 目标数较少的场景在后段已饱和, 截掉 CDF 尾部的平台
+            pmf = pmf[:int(np.searchsorted(cdf, 1 - 1e-12)) + 1]; cdf = cdf[:len(pmf)]
+            answer = dict(s, pulls=exact._calculate_percentiles(pmf, cdf), success_curve=(cdf * 100).tolist())
+            if s.get('budget') is not None:
+                answer['success_rate'] = exact._success_rate(cdf, s['budget'])
+            if aggregate is not None:
+                answer['returns'] = MonteCarloModel._calculate_percentiles(aggregate.column(aggregate.returns, k), is_float=True)
+            answers.append(answer)
+        result["scenarios"] = answers
+        return result
+
+    def _run_simulation(self):
+        mc = MonteCarloModel(dict(self.args, targetCount=self.max_targets, perTarget=True))
+        aggregate, seed = mc.simulate()
+
+        answers = []
+        for s in self.scenarios:
+            k = int(s['targetCount'])
+            pulls = aggregate.column(aggregate.pulls, k)
+            # 直方图的累计分布即所有预算下的成功率
+            curve = pulls.cdf() * 100
+            answer = dict(s, pulls=mc._calculate_percentiles(pulls), success_curve=curve.tolist())
+            if s.get('budget') is not None:
+                answer['success_rate'] = pulls.fraction_at_most(s['budget']) * 100
+            if self.args['pool'] == 'character':
+                answer['returns'] = mc._calculate_percentiles(aggregate.column(aggregate.returns, k), is_float=True)
+            answers.append(answer)
+        return {"scenarios": answers, "samples": aggregate.samples, "seed": seed}
+
+class PlannerModel:
+    """
+    反向预算规划: 给定预算 budget 与置信度 confidence (百分数, 默认 80), 求在该置信度下最多能获得几个目标,
+    并给出每个目标数在预算内达成的概率表。总抽数分布按获得目标后所在的入口层 (明光计数等) 分开保存,
+    每多一个目标只与单目标分布卷积一次, 不必为每个 targetCount 从头计算。
+    """
+    DEFAULT_CONFIDENCE = 80.0
+    MIN_REPORTED_RATE = 0.01 # 达成概率 (百分数) 低于该值后不再继续增加目标数
+
+    def __init__(self, args):
+        self.args = args
+        self.model_logic = MODEL_LOGIC[f"{args['game']}-{args['pool']}"]
+
+    def run(self):
+        if self.args.get('budget') is None: raise ValueError("plan mode requires 'budget'")
+        budget, confidence = max(int(self.args['budget']), 0), float(self.args.get('confidence', self.DEFAULT_CONFIDENCE))
+        if not 0 < confidence <= 100: raise ValueError("'confidence' must be a percentage in (0, 100]")
+        first, step = self.model_logic.get_single_target_pmfs(self.args['initialState'], budget)
+        # dist[e, n]: 已获得 k 个目标、共用 n 抽且之后位于入口 e 的概率 (n 截断到预算)
+        dist = np.zeros((len(first), budget + 1)); dist[:, :first.shape[1]] = first[:, :budget + 1]
+        table = []
+        for k in range(1, max(budget, 1) + 1): # 每个目标至少一抽, 目标数不会超过预算
+            rate = float(dist.sum()) * 100
+            table.append({"targetCount": k, "success_rate": rate})
+            if rate < self.MIN_REPORTED_RATE: break
+            dist = self._add_target(dist, step, budget)
+        reached = [row['targetCount'] for row in table if row['success_rate'] >= confidence]
+        return {"budget": budget, "confidence": confidence, "max_targets": max(reached, default=0), "table": table}
+
+    @staticmethod
+    def _add_target(dist, step, budget):
+        # 只卷积实际可达的 (入口 -> 下一入口) 组合, 单目标分布的支撑只有保底长度的数倍
+        nxt = np.zeros_like(dist)
+        for e in np.flatnonzero(dist.any(axis=1)):
+            for e2 in np.flatnonzero(step[e].any(axis=1)):
+                nxt[e2] += np.convolve(dist[e], step[e, e2])[:budget + 1]
+        return nxt
+
+class MultiBannerModel:
+    """
+    多卡池组合规划: legs 为依次抽取的若干段 {game, pool, initialState, targetCount} (如先抽角色再抽专武),
+    各段互不影响, 总抽数分布即各段精确 PMF 的卷积。每段只求一次分布, 段数较多或分布较长时整体用一次 FFT 相乘,
+    返回每段与合计的分位数、合计的 预算 -> 成功率 曲线, 以及给定 budget 时的成功率。
+    """
+    FFT_MIN_SIZE = 1024 # 合计分布长度不小于该值或段数超过 2 时改用 FFT 卷积
+
+    def __init__(self, args):
+        self.args = args
+        self.legs = args['legs']
+
+    def run(self):
+        pmfs = [MODEL_LOGIC[f"{leg['game']}-{leg['pool']}"].get_pull_distribution(leg['initialState'], int(leg['targetCount']))
+                for leg in self.legs]
+        legs = [dict(leg, pulls=ExactDistributionModel._calculate_percentiles(pmf, np.cumsum(pmf))) for leg, pmf in zip(self.legs, pmfs)]
+        with RequestProfile.phase('convolution'):
+            total = self.convolve(pmfs)
+        cdf = np.cumsum(total)
+        result = {"legs": legs, "pulls": ExactDistributionModel._calculate_percentiles(total, cdf), "success_curve": (cdf * 100).tolist()}
+        if self.args.get('budget') is not None:
+            result['success_rate'] = ExactDistributionModel._success_rate(cdf, self.args['budget'])
+        return result
+
+    @classmethod
+    def convolve(cls, pmfs):
+        """多个独立抽数分布之和的 PMF"""
+        size = sum(len(p) for p in pmfs) - len(pmfs) + 1
+        if len(pmfs) <= 2 and size < cls.FFT_MIN_SIZE:
+            return functools.reduce(np.convolve, pmfs, np.ones(1))
+        n = 1 << (size - 1).bit_length()
+        spectrum = functools.reduce(np.multiply, (np.fft.rfft(p, n) for p in pmfs))
+        # FFT 的舍入误差可能在尾部留下 1e-17 量级的负数
+        return np.clip(np.fft.irfft(spectrum, n)[:size], 0.0, None)
+
+# 卡池规格表: 新增卡池只需在此添加一项, 不需要新的类。字段名与 initialState 一致使用驼峰命名。
+#   pity5: 5星概率曲线, 第 pull 抽 (从 1 开始) 的概率为 base (pull < soft), base + (pull - soft + 1) * step, pull >= hard 时必出
+#   winRate: 小保底时不歪的概率
+#   counter: 可选的额外计数 (明光/命定值)。field 为 initialState 中的字段名, max 为计数取值个数, 计数达到 guaranteedAt 时必定不歪,
+#            winBonus 为小保底时额外的不歪概率, resetOnGuaranteedWin 为大保底获得目标后是否清零 (歪了总是加一, 小保底获得目标总是清零)
+#   four: 4星基础概率, UP概率, 常驻角色/其他(武器、光锥)数量, 常驻角色按持有数的返还 (新获得, 1~6命, 满命后), 其他的返还, UP四星返还 (未满命, 已满命)
+#   five: UP五星与常驻五星按持有数的返还 (新获得, 1~6命, 满命后), 常驻五星数量
+POOL_SPECS = {
+    "genshin-character": {
+        "pity5": {"base": 0.006, "soft": 74, "step": 0.06, "hard": 90},
+        "winRate": 0.5,
+        "counter": {"field": "mingguangCounter", "max": 4, "guaranteedAt": 3, "winBonus": 0.00018, "resetOnGuaranteedWin": False},
+        "four": {"base": 0.051, "upRate": 0.5, "stdChars": 39, "stdOthers": 18, "charReturns": (0, 2, 5), "otherReturn": 2, "upReturns": (2, 5)},
+        "five": {"upReturns": (10, 10, 25), "stdCount": 7, "stdReturns": (0, 10, 25)},
+    },
+    "genshin-weapon": {
+        "pity5": {"base": 0.007, "soft": 64, "step": 0.07, "hard": 80},
+        "winRate": 0.375,
+        "counter": {"field": "fatePoint", "max": 3, "guaranteedAt": 2, "winBonus": 0.0, "resetOnGuaranteedWin": True},
+        "four": {"base": 0.051, "upRate": 0.75, "stdChars": 39, "stdOthers": 18, "charReturns": (0, 2, 5), "otherReturn": 2, "upReturns": (2, 2)},
+        # 武器池5星只返还10星辉
+        "five": {"upReturns": (10, 10, 10), "stdCount": 1, "stdReturns": (10, 10, 10)},
+    },
+    "hsr-character": {
+        "pity5": {"base": 0.006, "soft": 74, "step": 0.06, "hard": 90},
+        "winRate": 0.5625, # 星铁没有明光机制, 使用纯粹的56.25/43.75概率
+        "counter": None,
+        "four": {"base": 0.051, "upRate": 0.5, "stdChars": 22, "stdOthers": 29, "charReturns": (0, 8, 20), "otherReturn": 8, "upReturns": (8, 20)},
+        "five": {"upReturns": (40, 40, 100), "stdCount": 7, "stdReturns": (0, 40, 100)},
+    },
+    "hsr-lightcone": {
+        "pity5": {"base": 0.008, "soft": 66, "step": 0.08, "hard": 80},
+        "winRate": 0.75,
+        "counter": None,
+        "four": {"base": 0.066, "upRate": 0.75, "stdChars": 22, "stdOthers": 29, "charReturns": (0, 8, 20), "otherReturn": 8, "upReturns": (8, 8)},
+        # 光锥池5星只返还40星芒
+        "five": {"upReturns": (40, 40, 40), "stdCount": 1, "stdReturns": (40, 40, 40)},
+    },
+}
 
 class GachaLogic:
-    def __init__(self):
+    """
+    由卡池规格编译出的共享概率表驱动的卡池逻辑, 数学模型与两种模拟引擎读取同一组数组。
+    状态下标为 pity + PITY_MAX * 层, 层 = 是否大保底 + 2 * 计数 (明光/命定值, 没有计数的卡池只有两层):
+      _P5_Table[pity], _P4_Table[pity]: 本抽为第 pity+1 抽时的5星概率与 (未出5星时的) 4星条件概率
+      _Win_Table[层]: 出5星时获得目标的概率; _Win_To[层] / _Lose_To[层]: 获得目标 / 歪了之后所在的层 (pity 归零)
+    """
+    MAX_COPIES = 8 # 持有数达到 8 即满命/满魂, 之后返还不再变化
+    MOMENT_ORDER = 3 # 解析计算的总抽数矩的最高阶数 (均值、方差、偏度)
+
+    def __init__(self, name, spec):
+        self.name, self.spec = name, spec
         # 延迟加载，只有在需要时才计算矩阵
         self.E_values = None
-    
-    def _ensure_tables_calculated(self):
-        if self.E_values is None:
-            A, b = self._build_transition_matrix()
-            self.E_values = np.linalg.solve(A, b)
-            
-    # 通用的状态更新逻辑
-    def _update_state_after_win(self, s, wg): s['pity'], s['isGuaranteed'] = 0, False
-    def _update_state_after_lose(self, s, wg): s['pity'], s['isGuaranteed'] = 0, True
+        self.Absorption_Probs = None
+        self.Moment_Tables = None
+        self._Chain = None
+        self._Fingerprint = None
 
-class GenshinCharacterLogic(GachaLogic):
-    PITY_MAX, GUARANTEE_MAX, MINGGUANG_MAX = 90, 2, 4
-    TOTAL_STATES = PITY_MAX * GUARANTEE_MAX * MINGGUANG_MAX
-    Absorption_Probs = None # 用于计算后续明光状态的概率
+        four, five = spec['four'], spec['five']
+        self.P4_BASE, self.UP4_RATE, self.UP4_RETURNS = four['base'], four['upRate'], tuple(four['upReturns'])
+        self.NUM_STD_4_CHARS, self.NUM_STD_4_OTHERS, self.OTHER_4_RETURN = four['stdChars'], four['stdOthers'], four['otherReturn']
+        self.NUM_STANDARD_5_STARS = five['stdCount']
+        # 收藏计数: 每次模拟一个定长整数数组, [0] 为UP五星, 随后依次为常驻五星、常驻四星角色
+        self._Std5_Offset = 1
+        self._Std4_Offset = 1 + self.NUM_STANDARD_5_STARS
+        self._Collection_Size = self._Std4_Offset + self.NUM_STD_4_CHARS
+        # 返还查找表: 下标为获得后的持有数 (封顶 MAX_COPIES)
+        tiers = lambda t: (0, t[0]) + (t[1],) * (self.MAX_COPIES - 2) + (t[2],)
+        self._Up5_Returns, self._Std5_Returns, self._Std4_Returns = map(tiers, (five['upReturns'], five['stdReturns'], four['charReturns']))
+        self._compile_tables()
 
-    def _ensure_tables_calculated(self):
-        if self.E_values is None: self.E_values = self._solve_expectations()
-        if self.Absorption_Probs is None: self.Absorption_Probs = self._solve_absorption_probabilities()
-
-    def _state_to_index(self, s): return s[0] + s[1]*self.PITY_MAX + s[2]*self.PITY_MAX*self.GUARANTEE_MAX
-    def _get_prob_5_star(self, p): pull=p+1; return 1. if pull>=90 else (0.006 if pull<74 else 0.006+(pull-73)*0.06)
-    def _get_win_lose_prob(self, is_g, mg=0):
-        if is_g or mg>=3: return 1.0, 0.0
-        p_mg=0.00018; p_win=p_mg+(1-p_mg)*0.5; p_lose=(1-p_mg)*0.5
-        return p_win, p_lose
-
-    def _solve_expectations(self):
-        A=np.identity(self.TOTAL_STATES); b=np.ones(self.TOTAL_STATES)
-        for i in range(self.TOTAL_STATES):
-            mg,is_g,p=i//(self.PITY_MAX*self.GUARANTEE_MAX),(i%(self.PITY_MAX*self.GUARANTEE_MAX))//self.PITY_MAX,i%self.PITY_MAX
-            p5=self._get_prob_5_star(p)
-            if p5<1.0: A[i,self._state_to_index((p+1,is_g,mg))]-=(1-p5)
-            if p5>0:
-                _,p_lose=self._get_win_lose_prob(is_g,mg)
-                if p_lose>0:
-                    new_mg=mg+1 if not is_g else mg
-                    A[i,self._state_to_index((0,1,min(new_mg,self.MINGGUANG_MAX-1)))]-=p5*p_lose
-        return np.linalg.solve(A,b)
-
-    def _solve_absorption_probabilities(self):
-        Q=np.zeros((self.TOTAL_STATES,self.TOTAL_STATES)); R=np.zeros((self.TOTAL_STATES,self.MINGGUANG_MAX))
-        for i in range(self.TOTAL_STATES):
-            mg,is_g,p=i//(self.PITY_MAX*self.GUARANTEE_MAX),(i%(self.PITY_MAX*self.GUARANTEE_MAX))//self.PITY_MAX,i%self.PITY_MAX
-            p5=self._get_prob_5_star(p)
-            if p5<1.0: Q[i,self._state_to_index((p+1,is_g,mg))]=(1-p5)
-            if p5>0:
-                p_win,p_lose=self._get_win_lose_prob(is_g,mg)
-                if p_lose>0:
-                    new_mg=mg+1 if not is_g else mg
-                    Q[i,self._state_to_index((0,1,min(new_mg,self.MINGGUANG_MAX-1)))]=p5*p_lose
-                if p_win>0:
-                    final_mg=0 if not is_g else mg
-                    R[i,final_mg]=p5*p_win
-        N=np.linalg.inv(np.identity(self.TOTAL_STATES)-Q); B=np.dot(N,R)
-        return B
+    def _compile_tables(self):
+        spec, curve, counter = self.spec, self.spec['pity5'], self.spec['counter']
+        self.PITY_MAX = curve['hard']
+        pull = np.arange(1, self.PITY_MAX + 1)
+        p5 = np.minimum(np.where(pull < curve['soft'], curve['base'], curve['base'] + (pull - curve['soft'] + 1) * curve['step']), 1.0)
+        p5[pull >= curve['hard']] = 1.0
+        self._P5_Table = p5
+        self._P4_Table = self.P4_BASE / np.where(p5 < 1, 1 - p5, 0.99)
 
-    def get_total_expectation(self, args):
-        self._ensure_tables_calculated()
-        initial_state=args['initialState']; target_count=args['targetCount']; total_pulls=0.0
-        start_state_index=self._state_to_index((initial_state['pity'],1 if initial_state['isGuaranteed']else 0,initial_state['mingguangCounter']))
-        pulls_for_first=self.E_values[start_state_index]
-        total_pulls+=pulls_for_first
-        if target_count > 1:
-            current_mg_dist=self.Absorption_Probs[start_state_index]
-            for i in range(2,target_count+1):
-                pulls_for_this_target=0; next_mg_dist=np.zeros(self.MINGGUANG_MAX)
-                for mg,prob in enumerate(current_mg_dist):
-                    if prob>1e-9:
-                        state_idx=self._state_to_index((0,0,mg)); exp_from_this_mg=self.E_values[state_idx]
-                        pulls_for_this_target+=prob*exp_from_this_mg
-                        next_mg_dist+=prob*self.Absorption_Probs[state_idx]
-                total_pulls+=pulls_for_this_target; current_mg_dist=next_mg_dist
-        return total_pulls
-
-    def get_one_target_pulls_sim(self,state,rng,collection,up4_c6):
-        pulls,returns_this_run=0,0
-        while True:
-            pulls+=1; state['pity']+=1; state['pity4']+=1; p5=self._get_prob_5_star(state['pity']-1)
-            if rng.get()<p5:
-                was_guaranteed=state['isGuaranteed']; p_win,_=self._get_win_lose_prob(was_guaranteed,state.get('mingguangCounter',0))
-                is_target=rng.get()<p_win; state['pity'],state['pity4']=0,0
-                if is_target:
-                    returns_this_run+=self._get_5_star_return(True,collection,rng); self._update_state_after_win(state,was_guaranteed); return pulls,returns_this_run
-                else:
-                    returns_this_run+=self._get_5_star_return(False,collection,rng); self._update_state_after_lose(state,was_guaranteed)
-            elif state['pity4']>=10 or rng.get()<0.051/(1-p5 if p5<1 else 0.99): returns_this_run+=self._handle_4_star_pull(state,rng,collection,up4_c6)
-    
-    def _get_5_star_return(self, is_up, c, rng):
-        NUM_STANDARD_5_STARS = 7
-        if is_up:
-            c['up_5_star'] = c.get('up_5_star', 0) + 1
-            return 10 if c['up_5_star'] <= 7 else 25
-        else:
-            char_index = int(rng.get() * NUM_STANDARD_5_STARS)
-            char_key = f"std_5_star_{char_index}"
-            c[char_key] = c.get(char_key, 0) + 1
-            if c[char_key] == 1: return 0
-            elif c[char_key] <= 7: return 10
-            else: return 25
-
-    # This logic is already correct for Genshin's 4-star pool
-    def _handle_4_star_pull(self,s,r,c,u):
-        s['pity4']=0; NUM_CHARS, NUM_WEAPONS = 39, 18
-        TOTAL_OFF_BANNER = NUM_CHARS + NUM_WEAPONS
-        if s['isGuaranteed4'] or r.get()<0.5: s['isGuaranteed4']=False; return 5 if u else 2
-        else:
-            s['isGuaranteed4']=True
-            if r.get() < NUM_CHARS / TOTAL_OFF_BANNER: # It's a character
-                i=f"std_char_{int(r.get()*NUM_CHARS)}"; c[i]=c.get(i,0)+1; return 0 if c[i]==1 else (2 if c[i]<=7 else 5)
-            else: # It's a weapon
-                return 2
-    
-    def _update_state_after_win(self,state,was_guaranteed):
-        super()._update_state_after_win(state,was_guaranteed)
-        if not was_guaranteed: state['mingguangCounter']=0
-        
-    def _update_state_after_lose(self,state,was_guaranteed):
-        super()._update_state_after_lose(state,was_guaranteed)
-        if not was_guaranteed: state['mingguangCounter'] = state.get('mingguangCounter', 0) + 1
+        count_max = counter['max'] if counter else 1
+        self.NUM_LAYERS = 2 * count_max
+        self.TOTAL_STATES = self.PITY_MAX * self.NUM_LAYERS
+        is_g, count = np.arange(self.NUM_LAYERS) % 2 == 1, np.arange(self.NUM_LAYERS) // 2
+        guaranteed = is_g | (count >= counter['guaranteedAt']) if counter else is_g
+        bonus = counter['winBonus'] if counter else 0.0
+        self._Win_Table = np.where(guaranteed, 1.0, bonus + (1 - bonus) * spec['winRate'])
+        keep = is_g & (not counter['resetOnGuaranteedWin']) if counter else np.zeros(self.NUM_LAYERS, dtype=bool)
+        self._Win_To = np.where(keep, 2 * count, 0)
+        self._Lose_To = 1 + 2 * np.minimum(count + 1, count_max - 1)
+        # 逐次模拟每抽都要查表, Python 列表的标量下标比 NumPy 数组快得多
+        self._Scalar_Tables = tuple(t.tolist() for t in (self._P5_Table, self._P4_Table, self._Win_Table, self._Win_To, self._Lose_To))
+
+    def layer_of(self, state_dict): return self.layer_for(self.spec, state_dict)
+
+    @staticmethod
+    def layer_for(spec, state_dict):
+        """只依赖卡池规格, 不需要编译概率表 (结果缓存计算键时使用)"""
+        counter = spec['counter']
+        count = min(int(state_dict.get(counter['field'], 0)), counter['max'] - 1) if counter else 0
+        return (1 if state_dict.get('isGuaranteed') else 0) + 2 * count
+
+    def state_index(self, state_dict):
+        return min(int(state_dict['pity']), self.PITY_MAX - 1) + self.PITY_MAX * self.layer_of(state_dict)
+
+    def new_collection(self): return [0] * self._Collection_Size
+
+    def _collect(self, c, slot, table):
+        """收藏数组 c 的 slot 位置计数加一, 按加一后的持有数查表得到返还"""
+        c[slot] += 1
+        return table[min(c[slot], self.MAX_COPIES)]
 
-class HSRCharacterLogic(GenshinCharacterLogic):
-    """Inherits from Genshin logic for simulation structure, but overrides return calculations."""
     def _get_5_star_return(self, is_up, c, rng):
-        # Simply call the parent (Genshin) logic and multiply by 4
-        genshin_returns = super()._get_5_star_return(is_up, c, rng)
-        return genshin_returns * 4
+        if is_up: return self._collect(c, 0, self._Up5_Returns)
+        # 常驻只有一项 (武器/光锥池不区分) 时不消耗随机数
+        slot = int(rng.get() * self.NUM_STANDARD_5_STARS) if self.NUM_STANDARD_5_STARS > 1 else 0
+        return self._collect(c, self._Std5_Offset + slot, self._Std5_Returns)
 
     def _handle_4_star_pull(self, s, r, c, u):
         s['pity4'] = 0
-        NUM_CHARS, NUM_LCS = 22, 29
-        TOTAL_OFF_BANNER = NUM_CHARS + NUM_LCS
-        
-        if s.get('isGuaranteed4', False) or r.get() < 0.5:
+        if s.get('isGuaranteed4', False) or r.get() < self.UP4_RATE:
             s['isGuaranteed4'] = False
-            return 20 if u else 8  # 5*4 or 2*4
-        else:
-            s['isGuaranteed4'] = True
-            if r.get() < NUM_CHARS / TOTAL_OFF_BANNER: # It's a character
-                i = f"std_char_{int(r.get() * NUM_CHARS)}"
-                c[i] = c.get(i, 0) + 1
-                if c[i] == 1: return 0
-                elif c[i] <= 7: return 8
-                else: return 20
-            else: # It's a light cone
-                return 8
-    def _get_win_lose_prob(self, is_g, mg=0):
-    # 覆盖父类的方法，移除明光机制，使用纯粹的56.25/43.75概率
-    # mg参数保留以兼容方法签名，但在此处无实际作用
-        return (1.0, 0.0) if is_g else (0.5625, 0.4375)
-
-class SimpleGachaModel(GachaLogic):
-    """Base class for Weapon, Light Cone, and HSR Character (Math) models."""
-    def get_expectation_for_state(self, state_dict):
-        self._ensure_tables_calculated()
-        state_tuple = self._dict_to_tuple(state_dict)
-        return self.E_values[self._state_to_index(state_tuple)]
-    
-    def get_subsequent_expectation(self):
-        self._ensure_tables_calculated()
-        return self.E_values[self._state_to_index(self.zero_state)]
+            return self.UP4_RETURNS[1 if u else 0]
+        # 歪了: 常驻角色 (计入收藏) 或常驻武器/光锥
+        s['isGuaranteed4'] = True
+        if r.get() < self.NUM_STD_4_CHARS / (self.NUM_STD_4_CHARS + self.NUM_STD_4_OTHERS):
+            return self._collect(c, self._Std4_Offset + int(r.get() * self.NUM_STD_4_CHARS), self._Std4_Returns)
+        return self.OTHER_4_RETURN
 
     def get_one_target_pulls_sim(self, state, rng, collection, up4_c6):
+        """逐次模拟直到获得一个目标; state['layer'] 为 layer_of 给出的层"""
+        P5, P4, WIN, WIN_TO, LOSE_TO = self._Scalar_Tables
         pulls, returns_this_run = 0, 0
         while True:
-            pulls += 1
-            state['pity'] += 1
-            state['pity4'] += 1
-            p5 = self._get_prob_5_star(state['pity'] - 1)
-            if rng.get() < p5:
-                was_guaranteed = state['isGuaranteed'] or state.get('fatePoint', 0) >= 2
-                p_win, _ = self._get_win_lose_prob(was_guaranteed)
-                is_target = rng.get() < p_win
-                state['pity'], state['pity4'] = 0, 0
-                if is_target:
+            pulls += 1; state['pity'] += 1; state['pity4'] += 1
+            p_idx = min(state['pity'], self.PITY_MAX) - 1
+            if rng.get() < P5[p_idx]:
+                layer = state['layer']; state['pity'], state['pity4'] = 0, 0
+                if rng.get() < WIN[layer]:
                     returns_this_run += self._get_5_star_return(True, collection, rng)
-                    self._update_state_after_win(state, was_guaranteed)
+                    state['layer'] = WIN_TO[layer]
                     return pulls, returns_this_run
-                else:
-                    returns_this_run += self._get_5_star_return(False, collection, rng)
-                    self._update_state_after_lose(state, was_guaranteed)
-            elif state['pity4'] >= 10 or rng.get() < (0.051 / (1 - p5 if p5 < 1 else 0.99)):
+                returns_this_run += self._get_5_star_return(False, collection, rng)
+                state['layer'] = LOSE_TO[layer]
+            elif state['pity4'] >= 10 or rng.get() < P4[p_idx]:
                 returns_this_run += self._handle_4_star_pull(state, rng, collection, up4_c6)
-    
-    def _get_5_star_return(self, is_up, c, rng): return 10
-    def _handle_4_star_pull(self, s, r, c, u): s['pity4'] = 0; return 2
 
-class GenshinWeaponModel(SimpleGachaModel):
-    PITY_MAX, FATE_MAX, GUARANTEE_MAX = 80, 3, 2 # 新增 GUARANTEE_MAX
-    TOTAL_STATES = PITY_MAX * FATE_MAX * GUARANTEE_MAX # <--- 修正计算方式
-    zero_state = (0, 0, False)
-    
-    def _dict_to_tuple(self, d): return (d['pity'], d.get('fatePoint', 0), d['isGuaranteed'])
-    def _state_to_index(self, s): return s[0] + s[1] * self.PITY_MAX + (1 if s[2] else 0) * self.PITY_MAX * self.FATE_MAX
-    def _get_prob_5_star(self, p):
-        pull = p + 1; return 1. if pull >= 80 else (0.007 if pull < 64 else 0.007 + (pull - 63) * 0.07)
-    def _get_win_lose_prob(self, is_g_or_fate_full): return (1.0, 0.0) if is_g_or_fate_full else (0.375, 0.625)
-    def _build_transition_matrix(self):
-        A, b = np.identity(self.TOTAL_STATES), np.ones(self.TOTAL_STATES)
-        for i in range(self.TOTAL_STATES):
-            guaranteed, fate, pity = i // (self.PITY_MAX * self.FATE_MAX), (i % (self.PITY_MAX * self.FATE_MAX)) // self.PITY_MAX, i % self.PITY_MAX
-            p5 = self._get_prob_5_star(pity)
-            is_g_or_fate_full = guaranteed or fate >= 2
-            if p5 < 1.0: A[i, self._state_to_index((pity + 1, fate, guaranteed))] -= (1.0 - p5)
-            if p5 > 0:
-                p_win, p_lose = self._get_win_lose_prob(is_g_or_fate_full)
-                if p_lose > 0: A[i, self._state_to_index((0, min(fate + 1, self.FATE_MAX - 1), True))] -= p5 * p_lose
-        return A, b
-    def _update_state_after_win(self, s, wg): s['pity'], s['fatePoint'], s['isGuaranteed'] = 0, 0, False
-    def _update_state_after_lose(self, s, wg): s['pity'], s['fatePoint'], s['isGuaranteed'] = 0, min(s.get('fatePoint',0) + 1, self.FATE_MAX - 1), True
-
-class GenshinWeaponLogic(GenshinWeaponModel):
+    def _ensure_tables_calculated(self):
+        with RequestProfile.phase('tables'):
+            if self.E_values is None:
+                self.E_values = self._cached_table('E_values', lambda: self._solve_chain(np.ones(self.TOTAL_STATES)))
+            if self.Absorption_Probs is None:
+                self.Absorption_Probs = self._cached_table('Absorption_Probs', lambda: self._solve_chain(self.get_absorbing_chain()[1]))
+
+    def get_total_expectation(self, args):
+        """多个目标的总期望: 每获得一个目标后按吸收概率得到下一目标入口层 (明光计数等) 的分布"""
+        if args['targetCount'] <= 0: return 0.0 # 与 get_total_moments 一致
+        self._ensure_tables_calculated()
+        entries = self.get_absorbing_chain()[2]
+        start = self.state_index(args['initialState'])
+        total_pulls, entry_dist = self.E_values[start], self.Absorption_Probs[start]
+        for _ in range(1, args['targetCount']):
+            total_pulls += entry_dist @ self.E_values[entries]
+            entry_dist = entry_dist @ self.Absorption_Probs[entries]
+        return float(total_pulls)
+
+    def _ensure_moments_calculated(self):
+        with RequestProfile.phase('tables'):
+            if self.Moment_Tables is None: self.Moment_Tables = self._cached_table('Moments', self._solve_moments)
+
+    def _solve_moments(self):
+        """
+        M[r][i, e] = E[T^r · 1{获得目标后进入入口 entries[e]}], T 为从状态 i 出发获得一个目标所需的抽数 (M[0] 即吸收概率)。
+        第一抽之后 T = 1 + T', 展开 (1 + T')^r 得 (I - Q) M[r] = R + Σ_{s<r} C(r,s) Q M[s], 逐阶用 _solve_chain 求解。
+        """
+        (rows, cols, vals), R, _ = self.get_absorbing_chain()
+        moments, q_moments = [], []
+        for r in range(self.MOMENT_ORDER + 1):
+            b = R + sum(math.comb(r, s) * q_moments[s] for s in range(r))
+            moments.append(self._solve_chain(b))
+            q_moment = np.zeros_like(R); np.add.at(q_moment, rows, vals[:, None] * moments[-1][cols])
+            q_moments.append(q_moment)
+        return np.array(moments)
+
+    def get_total_moments(self, args):
+        """
+        返回总抽数 S 的原点矩 [E[S], E[S^2], E[S^3]]。G[r][e] = E[S_k^r · 1{第 k 个目标后位于入口 e}],
+        每多一个目标按二项式展开与单目标的联合矩表卷积, 入口层 (明光计数等) 的传递与 get_total_expectation 相同。
+        """
+        self._ensure_moments_calculated()
+        M, entries, order = self.Moment_Tables, self.get_absorbing_chain()[2], self.MOMENT_ORDER
+        if args['targetCount'] <= 0: return [0.0] * order
+        G = M[:, self.state_index(args['initialState'])]
+        step = M[:, entries] # step[r][e, e']: 从入口 e 出发获得下一个目标的联合矩
+        for _ in range(1, args['targetCount']):
+            G = np.array([sum(math.comb(r, s) * G[s] @ step[r - s] for s in range(r + 1)) for r in range(order + 1)])
+        return [float(m) for m in G[1:].sum(axis=1)]
+
+    def get_single_target_pmfs(self, state_dict, max_pulls, tail=1e-15):
+        """
+        单个目标的抽数与之后所在入口的联合分布, 抽数截断到 max_pulls, 返回 (first, step):
+        first[e, t] 为从 state_dict 出发恰好第 t 抽获得目标、之后位于入口 entries[e] 的概率, step[e, e', t] 为从入口 e 出发的同一概率。
+        所有起点的概率向量在吸收链上一起传播, 剩余质量低于 tail 时提前结束 (单目标最多需要数倍保底抽数)。
+        """
+        (rows, cols, vals), R, entries = self.get_absorbing_chain()
+        starts = np.concatenate([[self.state_index(state_dict)], entries]); m = len(starts)
+        V = np.zeros((self.TOTAL_STATES, m)); V[starts, np.arange(m)] = 1.0
+        flat_cols = (cols[:, None] * m + np.arange(m)).ravel()
+        pmfs = [np.zeros((m, len(entries)))]
+        with RequestProfile.phase('distribution'):
+            while len(pmfs) <= max_pulls and V.sum() > tail:
+                pmfs.append(V.T @ R)
+                V = np.bincount(flat_cols, weights=(V[rows] * vals[:, None]).ravel(), minlength=self.TOTAL_STATES * m).reshape(-1, m)
+        out = np.moveaxis(np.array(pmfs), 0, -1)
+        return out[0], out[1:]
+
+    def get_absorbing_chain(self):
+        """返回 (Q, R, entries): Q 为单个目标内的稀疏转移 (rows, cols, vals), R[:, j] 为获得目标后进入下一目标入口状态 entries[j] 的概率"""
+        if self._Chain is None:
+            with RequestProfile.phase('tables'):
+                Q, R = self._build_absorbing_chain()
+                self._Chain = (Q, R, self.PITY_MAX * np.arange(self.NUM_LAYERS))
+        return self._Chain
+
+    def _build_absorbing_chain(self):
+        # 由编译好的表直接生成所有状态的边: 未出5星 pity+1; 歪了进入 _Lose_To 层的 pity 0; 获得目标进入 _Win_To 层的入口
+        P = self.PITY_MAX
+        pity, layer = np.tile(np.arange(P), self.NUM_LAYERS), np.repeat(np.arange(self.NUM_LAYERS), P)
+        index = pity + P * layer
+        p5, p_win = self._P5_Table[pity], self._Win_Table[layer]
+        forward, lose = p5 < 1, p5 * (1 - p_win) > 0
+        rows = np.concatenate([index[forward], index[lose]])
+        cols = np.concatenate([index[forward] + 1, P * self._Lose_To[layer[lose]]])
+        vals = np.concatenate([1 - p5[forward], (p5 * (1 - p_win))[lose]])
+        R = np.zeros((self.TOTAL_STATES, self.NUM_LAYERS))
+        R[index, self._Win_To[layer]] = p5 * p_win
+        return (rows, cols, vals), R
+
+    def _solve_chain(self, b):
+        """
+        求解 x = Qx + b (b 可以有多列)。所有卡池的状态下标都是 pity + PITY_MAX * 层, 层内只有 pity -> pity+1 的前进边,
+        其余的边都回到某一层的 pity 0。在每层内沿 pity 反向递推, 把 x 表示为 alpha + beta @ z (z 为各层 pity 0 处的解),
+        最后只需解一个 层数×层数 的小方程组, 时间与内存都与保底长度成线性关系。
+        """
+        P = self.PITY_MAX; L = self.TOTAL_STATES // P
+        rows, cols, vals = self.get_absorbing_chain()[0]
+        b = np.asarray(b, dtype=float); rhs = b.reshape(L, P, -1)
+        forward = (cols == rows + 1) & (cols % P != 0)
+        if not np.all(forward | (cols % P == 0)):
+            raise ValueError(f"{self.name}: 转移链不满足 '前进或回到 pity 0' 的结构")
+        f = np.zeros((L, P)); f[rows[forward] // P, rows[forward] % P] = vals[forward]
+        C = np.zeros((L, P, L)); reset = ~forward
+        np.add.at(C, (rows[reset] // P, rows[reset] % P, cols[reset] // P), vals[reset])
+
+        alpha, beta = np.zeros((L, P, rhs.shape[2])), np.zeros((L, P, L))
+        next_alpha, next_beta = np.zeros((L, rhs.shape[2])), np.zeros((L, L))
+        for p in range(P - 1, -1, -1):
+            next_alpha = alpha[:, p] = rhs[:, p] + f[:, p, None] * next_alpha
+            next_beta = beta[:, p] = C[:, p] + f[:, p, None] * next_beta
+        z = np.linalg.solve(np.identity(L) - beta[:, 0], alpha[:, 0])
+        return (alpha + beta @ z).reshape(b.shape)
+
+    def _pool_fingerprint(self):
+        """编译后转移表的摘要: 概率、歪/不歪规则或保底上限变化时摘要随之变化, 对应的旧缓存自动失效"""
+        if self._Fingerprint is None:
+            params = [TABLE_CACHE_VERSION, self.PITY_MAX, self.NUM_LAYERS] + [t.tolist() for t in (self._P5_Table, self._Win_Table, self._Win_To, self._Lose_To)]
+            self._Fingerprint = hashlib.sha1(repr(params).encode()).hexdigest()[:16]
+        return self._Fingerprint
+
+    def _cached_table(self, name, solve):
+        """优先从磁盘缓存内存映射加载已求解的表, 否则求解并写入缓存 (写入失败不影响计算)"""
+        if not TABLE_CACHE_DIR: return solve()
+        path = os.path.join(TABLE_CACHE_DIR, f"{self.name}-{self._pool_fingerprint()}-{name}.npy")
+        try:
+            return np.load(path, mmap_mode='r')
+        except (OSError, ValueError):
+            pass
+        table = solve()
+        try:
+            os.makedirs(TABLE_CACHE_DIR, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f: np.save(f, table)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+        self._remove_stale_tables(name)
+        return table
+
+    def _remove_stale_tables(self, name):
+        """删除同一卡池、同名表的其他摘要版本 (卡池规格或构建方式修改前写入的旧缓存)"""
+        current = f"{self.name}-{self._pool_fingerprint()}-{name}.npy"
+        pattern = os.path.join(glob.escape(TABLE_CACHE_DIR), f"{glob.escape(self.name)}-{'?' * 16}-{glob.escape(name)}.npy")
+        for path in glob.glob(pattern):
+            if os.path.basename(path) == current: continue
+            try:
+                os.remove(path)
+            except OSError: # 其他进程可能已删除或仍在使用
+                pass
+
+    def get_pull_distribution(self, state_dict, target_count, tail=1e-12):
+        """返回获得 target_count 个目标所需总抽数的精确 PMF (下标即抽数)"""
+        if target_count <= 0: return np.ones(1)
+        return self.get_pull_distributions(state_dict, target_count, tail)[-1]
+
+    def get_pull_distributions(self, state_dict, target_count, tail=1e-12):
+        """
+        在吸收链上逐抽传播概率向量, 一次得到获得 1..target_count 个目标所需总抽数的精确 PMF, 第 k-1 行对应 k 个目标。
+        K 个目标的链按层展开: 第 k 层表示正在抽第 k+1 个目标, 获得目标后转入下一层的入口状态,
+        因此每一抽离开第 k 层的概率质量就是第 k+1 个目标恰好在这一抽获得的概率。
+        """
+        (q_rows, q_cols, q_vals), R, entries = self.get_absorbing_chain()
+        S, K = self.TOTAL_STATES, target_count
+        r_rows, r_cols = np.nonzero(R); r_vals = R[r_rows, r_cols]
+        offsets = np.arange(K)[:, None] * S
+        # 稀疏转移 (COO): 层内转移 + 获得目标后进入下一层
+        rows = np.concatenate([(q_rows + offsets).ravel(), (r_rows + offsets[:-1]).ravel()])
+        cols = np.concatenate([(q_cols + offsets).ravel(), (np.asarray(entries)[r_cols] + offsets[1:]).ravel()])
+        vals = np.concatenate([np.tile(q_vals, K), np.tile(r_vals, K - 1)])
+
+        v = np.zeros(K * S); v[self.state_index(state_dict)] = 1.0
+        pmfs, remaining = [np.zeros(K)], 1.0
+        max_pulls = K * self.TOTAL_STATES # 宽松上界, 防止异常参数导致死循环
+        with RequestProfile.phase('distribution'):
+            while remaining > tail and len(pmfs) <= max_pulls:
+                pmfs.append(v.reshape(K, S)[:, r_rows] @ r_vals)
+                v = np.bincount(cols, weights=v[rows] * vals, minlength=K * S)
+                remaining = v.sum()
+        return np.array(pmfs).T
+
+    # ---- 批量(向量化)模拟: 状态字典中的每一项都是长度为模拟次数的数组 ----
+    def new_batch_collection(self, n): return np.zeros((n, self._Collection_Size), dtype=np.int32)
+
+    def batch_pull_step(self, s, act, rng, c, up4_c6):
+        """所有 act 为真的模拟同时抽一次, 返回 (本抽返还, 本抽是否获得目标)"""
+        s['pity'] += act; s['pity4'] += act
+        p_idx = np.minimum(s['pity'] - 1, self.PITY_MAX - 1)
+        u = rng.random((2, act.size))
+        hit5 = act & (u[0] < self._P5_Table[p_idx])
+        # 出5星与出4星两个分支互斥, 第二行随机数在两者之间复用
+        win = hit5 & (u[1] < self._Win_Table[s['layer']])
+        lose = hit5 & ~win
+        hit4 = act & ~hit5 & ((s['pity4'] >= 10) | (u[1] < self._P4_Table[p_idx]))
+
+        returns = np.zeros(act.size)
+        if hit5.any():
+            s['pity'][hit5], s['pity4'][hit5] = 0, 0
+            returns += self._batch_5_star_return(win, lose, c, rng)
+            s['layer'][win] = self._Win_To[s['layer'][win]]
+            s['layer'][lose] = self._Lose_To[s['layer'][lose]]
+        if hit4.any():
+            returns += self._batch_4_star_return(s, hit4, rng, c, up4_c6)
+        return returns, win
+
+    def _batch_collect(self, c, rows, slots, table):
+        """_collect 的向量化形式: 第 rows[i] 个模拟的 slots[i] 位置计数加一并查表 (每个模拟每抽最多一次)"""
+        c[rows, slots] += 1
+        return np.asarray(table)[np.minimum(c[rows, slots], self.MAX_COPIES)]
+
+    def _batch_5_star_return(self, win, lose, c, rng):
+        returns = np.zeros(win.size)
+        win_rows, lose_rows = np.flatnonzero(win), np.flatnonzero(lose)
+        returns[win_rows] = self._batch_collect(c, win_rows, 0, self._Up5_Returns)
+        slots = self._Std5_Offset
+        if self.NUM_STANDARD_5_STARS > 1:
+            slots = slots + (rng.random(lose_rows.size) * self.NUM_STANDARD_5_STARS).astype(np.intp)
+        returns[lose_rows] = self._batch_collect(c, lose_rows, slots, self._Std5_Returns)
+        return returns
+
+    def _batch_4_star_return(self, s, hit4, rng, c, up4_c6):
+        s['pity4'][hit4] = 0
+        returns = np.zeros(hit4.size)
+        rows = np.flatnonzero(hit4); r = rng.random((2, rows.size))
+        up = s['isGuaranteed4'][rows] | (r[0] < self.UP4_RATE)
+        s['isGuaranteed4'][rows] = ~up
+        returns[rows[up]] = self.UP4_RETURNS[1 if up4_c6 else 0]
+        is_char = r[1] < self.NUM_STD_4_CHARS / (self.NUM_STD_4_CHARS + self.NUM_STD_4_OTHERS)
+        returns[rows[~up & ~is_char]] = self.OTHER_4_RETURN
+        char_rows = rows[~up & is_char]
+        slots = self._Std4_Offset + (rng.random(char_rows.size) * self.NUM_STD_4_CHARS).astype(np.intp)
+        returns[char_rows] = self._batch_collect(c, char_rows, slots, self._Std4_Returns)
+        return returns
+
+    def simulate_full_runs(self, kernel, n, args, seed):
+        """用编译后的内核完成 n 次完整模拟, 返回与 _simulate_scalar 形状相同的累计抽数与累计返还, 以及取用的随机数个数"""
+        init = args['initialState']
+        return kernel(n, args['targetCount'], seed, int(init['pity']), self.layer_of(init),
+                      self._P5_Table, self._P4_Table, self._Win_Table, self._Win_To, self._Lose_To,
+                      np.array(self._Up5_Returns, dtype=float), np.array(self._Std5_Returns, dtype=float), np.array(self._Std4_Returns, dtype=float),
+                      float(self.UP4_RETURNS[1 if args.get('up4C6', False) else 0]), float(self.OTHER_4_RETURN), self.UP4_RATE,
+                      self.NUM_STD_4_CHARS / (self.NUM_STD_4_CHARS + self.NUM_STD_4_OTHERS), self.NUM_STANDARD_5_STARS, self.NUM_STD_4_CHARS)
+
+def _full_runs_kernel(n, target_count, seed, pity0, layer0, p5, p4, win, win_to, lose_to,
+                      up5_returns, std5_returns, std4_returns, up4_return, other_return, up4_rate, std4_char_share, num_std5, num_std4):
     """
-    为原神武器池计算返还星辉
+    MonteCarloModel._simulate_one_full_run 与 GachaLogic.get_one_target_pulls_sim 的数组版本, 供 Numba 编译。
+    只使用整数、浮点与 NumPy 数组, 随机数的抽取顺序与纯 Python 实现一致; 收藏数组布局同 GachaLogic.new_collection。
+    draws 记录取用的随机数个数, 对应纯 Python 实现的 rng_draws 统计。
     """
-    def get_one_target_pulls_sim(self, state, rng, collection, up4_c6):
-        pulls, returns_this_run = 0, 0
-        while True:
-            pulls += 1
-            state['pity'] += 1
-            state['pity4'] += 1
-            p5 = self._get_prob_5_star(state['pity'] - 1)
-            
-            # 抽中5星
-            if rng.get() < p5:
-                was_guaranteed = state['isGuaranteed'] or state.get('fatePoint', 0) >= 2
-                p_win, _ = self._get_win_lose_prob(was_guaranteed)
-                is_target = rng.get() < p_win
-                state['pity'], state['pity4'] = 0, 0
-                
-                returns_this_run += self._get_5_star_return(is_target, collection, rng)
-                if is_target:
-                    self._update_state_after_win(state, was_guaranteed)
-                    return pulls, returns_this_run
-                else:
-                    self._update_state_after_lose(state, was_guaranteed)
-            
-            # 抽中4星 (基于10连保底或基础概率)
-            elif state['pity4'] >= 10 or rng.get() < (0.051 / (1 - p5 if p5 < 1 else 0.99)):
-                 returns_this_run += self._handle_4_star_pull(state, rng, collection, up4_c6)
+    np.random.seed(seed)
+    pity_max, max_copies = p5.shape[0], up5_returns.shape[0] - 1
+    std5_offset, std4_offset = 1, 1 + num_std5
+    out_pulls, out_returns = np.zeros((n, target_count), dtype=np.int64), np.zeros((n, target_count))
+    collection = np.zeros(std4_offset + num_std4, dtype=np.int64)
+    draws = 0
+    for run in range(n):
+        collection[:] = 0
+        pity, layer, pity4, guaranteed4 = pity0, layer0, 0, False
+        pulls, returns = 0, 0.0
+        for k in range(target_count):
+            while True:
+                pulls += 1; pity += 1; pity4 += 1
+                p_idx = min(pity, pity_max) - 1
+                draws += 1
+                if np.random.random() < p5[p_idx]:
+                    pity, pity4 = 0, 0
+                    draws += 1
+                    if np.random.random() < win[layer]:
+                        collection[0] += 1
+                        returns += up5_returns[min(collection[0], max_copies)]
+                        layer = win_to[layer]
+                        break
+                    draws += num_std5 > 1
+                    slot = std5_offset + (int(np.random.random() * num_std5) if num_std5 > 1 else 0)
+                    collection[slot] += 1
+                    returns += std5_returns[min(collection[slot], max_copies)]
+                    layer = lose_to[layer]
+                    continue
+                draws += pity4 < 10
+                if pity4 >= 10 or np.random.random() < p4[p_idx]:
+                    pity4 = 0
+                    draws += not guaranteed4
+                    if guaranteed4 or np.random.random() < up4_rate:
+                        guaranteed4 = False
+                        returns += up4_return
+                    else:
+                        guaranteed4 = True
+                        draws += 1
+                        if np.random.random() < std4_char_share:
+                            draws += 1
+                            slot = std4_offset + int(np.random.random() * num_std4)
+                            collection[slot] += 1
+                            returns += std4_returns[min(collection[slot], max_copies)]
+                        else:
+                            returns += other_return
+            out_pulls[run, k], out_returns[run, k] = pulls, returns
+    return out_pulls, out_returns, draws
 
-    def _get_5_star_return(self, is_up, c, rng):
-        # 武器池5星只返还10星辉
-        return 10
+_JIT_KERNEL = None
 
-    def _handle_4_star_pull(self, s, r, c, u):
-        s['pity4'] = 0
-        
-        # 武器池的4星UP概率为75%
-        if s.get('isGuaranteed4', False) or r.get() < 0.75:
-            s['isGuaranteed4'] = False
-            # 获得UP四星武器，返还2星辉
-            return 2
-        else:
-            s['isGuaranteed4'] = True
-            # 歪了，此时可能获得常驻武器或常驻角色
-            # 此处假设角色和武器概率均等 (50/50)
-            NUM_CHARS, NUM_WEAPONS = 39, 18 # 引用原神角色池的常驻数量
-            TOTAL_OFF_BANNER = NUM_CHARS + NUM_WEAPONS
-
-            if r.get() < NUM_CHARS / TOTAL_OFF_BANNER: # 模拟抽到了角色
-                i = f"std_char_{int(r.get() * NUM_CHARS)}"
-                c[i] = c.get(i, 0) + 1
-                if c[i] == 1: return 0      # New: 0 星辉
-                elif c[i] <= 7: return 2  # 1-6命: 2 星辉
-                else: return 5              # 满命后: 5 星辉
-            else: # 模拟抽到了武器
-                return 2
-
-class HSRCharacterModel(SimpleGachaModel):
-    PITY_MAX, GUARANTEE_MAX = 90, 2
-    TOTAL_STATES = PITY_MAX * GUARANTEE_MAX
-    zero_state = (0, 0)
-
-    def _dict_to_tuple(self, d): return (d['pity'], 1 if d['isGuaranteed'] else 0)
-    def _state_to_index(self, s): return s[0] + s[1] * self.PITY_MAX
-    def _get_prob_5_star(self, p):
-        pull = p + 1; return 1. if pull >= 90 else (0.006 if pull < 74 else 0.006 + (pull - 73) * 0.06)
-    def _get_win_lose_prob(self, is_g): return (1.0, 0.0) if is_g else (0.5, 0.5) # HSR is 50/50
-    def _build_transition_matrix(self):
-        A, b = np.identity(self.TOTAL_STATES), np.ones(self.TOTAL_STATES)
-        for i in range(self.TOTAL_STATES):
-            is_g, pity = i // self.PITY_MAX, i % self.PITY_MAX
-            p5 = self._get_prob_5_star(pity)
-            if p5 < 1.0: A[i, self._state_to_index((pity + 1, is_g))] -= (1.0 - p5)
-            if p5 > 0:
-                _, p_lose = self._get_win_lose_prob(is_g)
-                if p_lose > 0: A[i, self._state_to_index((0, 1))] -= p5 * p_lose
-        return A, b
-    
-    def _get_5_star_return(self, is_up, c, rng):
-        NUM_STANDARD_5_STARS = 7
-        if is_up:
-            c['up_5_star'] = c.get('up_5_star', 0) + 1
-            return 40 if c['up_5_star'] <= 7 else 100
-        else:
-            char_index = int(rng.get() * NUM_STANDARD_5_STARS)
-            char_key = f"std_5_star_{char_index}"
-            c[char_key] = c.get(char_key, 0) + 1
-            if c[char_key] == 1: return 0
-            elif c[char_key] <= 7: return 40
-            else: return 100
-            
-    def _handle_4_star_pull(self, s, r, c, u):
-        s['pity4'] = 0
-        NUM_CHARS, NUM_LCS = 22, 29
-        TOTAL_OFF_BANNER = NUM_CHARS + NUM_LCS
-        if s.get('isGuaranteed4', False) or r.get() < 0.5:
-            s['isGuaranteed4'] = False
-            return 20 if u else 8
-        else:
-            s['isGuaranteed4'] = True
-            if r.get() < NUM_CHARS / TOTAL_OFF_BANNER:
-                char_index = int(r.get() * NUM_CHARS)
-                char_key = f"std_char_{char_index}"
-                c[char_key] = c.get(char_key, 0) + 1
-                if c[char_key] == 1: return 0
-                elif c[char_key] <= 7: return 8
-                else: return 20
-            else:
-                return 8
-
-class HSRLightConeModel(SimpleGachaModel):
-    PITY_MAX, GUARANTEE_MAX = 80, 2
-    TOTAL_STATES = PITY_MAX * GUARANTEE_MAX
-    zero_state = (0, 0)
-
-    def _dict_to_tuple(self, d): return (d['pity'], 1 if d['isGuaranteed'] else 0)
-    def _state_to_index(self, s): return s[0] + s[1] * self.PITY_MAX
-    def _get_prob_5_star(self, p):
-        pull = p + 1; return 1. if pull >= 80 else (0.008 if pull < 66 else 0.008 + (pull - 65) * 0.08)
-    def _get_win_lose_prob(self, is_g): return (1.0, 0.0) if is_g else (0.75, 0.25)
-    def _build_transition_matrix(self):
-        A, b = np.identity(self.TOTAL_STATES), np.ones(self.TOTAL_STATES)
-        for i in range(self.TOTAL_STATES):
-            is_g, pity = i // self.PITY_MAX, i % self.PITY_MAX
-            p5 = self._get_prob_5_star(pity)
-            if p5 < 1.0: A[i, self._state_to_index((pity + 1, is_g))] -= (1.0 - p5)
-            if p5 > 0:
-                _, p_lose = self._get_win_lose_prob(is_g)
-                if p_lose > 0: A[i, self._state_to_index((0, 1))] -= p5 * p_lose
-        return A, b
-    
-    def _get_5_star_return(self, is_up, c, rng): return 40
-    def _handle_4_star_pull(self, s, r, c, u): s['pity4'] = 0; return 8
+def _jit_kernel():
+    """首次使用时编译逐次模拟内核 (cache=True: 编译结果缓存在磁盘, 之后的进程直接加载); 未安装 Numba 时返回 None"""
+    global _JIT_KERNEL
+    if _JIT_KERNEL is None:
+        _import_numpy() # 内核编译时按全局变量解析 np, 必须已是真正的 NumPy 模块
+        try:
+            from numba import njit # type: ignore
+            _JIT_KERNEL = njit(cache=True, nogil=True)(_full_runs_kernel)
+        except ImportError:
+            _JIT_KERNEL = False
+    return _JIT_KERNEL or None
+
+class PoolRegistry(collections.abc.Mapping):
+    """卡池名 -> GachaLogic 的惰性注册表: 只有实际被请求的卡池才会创建并编译概率表"""
+    def __init__(self, specs):
+        self._specs, self._pools, self._lock = specs, {}, threading.Lock()
+
+    def __getitem__(self, name):
+        pool = self._pools.get(name)
+        if pool is None:
+            spec = self._specs[name]
+            with self._lock:
+                pool = self._pools.get(name)
+                if pool is None: pool = self._pools[name] = GachaLogic(name, spec)
+        return pool
+
+    def __iter__(self): return iter(self._specs)
+    def __len__(self): return len(self._specs)
 
-class HSRLightConeLogic(HSRLightConeModel):
+MODEL_LOGIC = PoolRegistry(POOL_SPECS)
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED
+
+class ResultCache:
     """
-    为星铁光锥池提供精细化模拟，以计算返还星芒。
+    请求结果缓存, 键为规范化后的 args: 进程内 LRU + 磁盘 LRU (每个结果一个 JSON 文件, 命中时刷新修改时间,
+    总大小超过上限时删除最久未访问的文件)。一次性命令行与常驻模式都经由 run_request 共用磁盘层。
+    未指定 seed 的模拟请求同样会命中缓存, 返回结果中带有当时使用的种子, 可据此复现。
     """
-    def get_one_target_pulls_sim(self, state, rng, collection, up4_c6):
-        pulls, returns_this_run = 0, 0
-        while True:
-            pulls += 1
-            state['pity'] += 1
-            state['pity4'] += 1
-            p5 = self._get_prob_5_star(state['pity'] - 1)
-            
-            if rng.get() < p5:
-                was_guaranteed = state['isGuaranteed']
-                p_win, _ = self._get_win_lose_prob(was_guaranteed)
-                is_target = rng.get() < p_win
-                state['pity'], state['pity4'] = 0, 0
-                
-                returns_this_run += self._get_5_star_return(is_target, collection, rng)
-                if is_target:
-                    self._update_state_after_win(state, was_guaranteed)
-                    return pulls, returns_this_run
-                else:
-                    self._update_state_after_lose(state, was_guaranteed)
-            
-            elif state['pity4'] >= 10 or rng.get() < (0.066 / (1 - p5 if p5 < 1 else 0.99)):
-                 returns_this_run += self._handle_4_star_pull(state, rng, collection, up4_c6)
-    
-    def _get_5_star_return(self, is_up, c, rng):
-        # 光锥池5星只返还40星芒
-        return 40
+    IGNORED_ARGS = ('workers', 'cache', 'stream') # 不影响结果的参数
 
-    def _handle_4_star_pull(self, s, r, c, u):
-        s['pity4'] = 0
-        
-        if s.get('isGuaranteed4', False) or r.get() < 0.75:
-            s['isGuaranteed4'] = False
-            return 8 # UP四星光锥返还8星芒
-        else:
-            s['isGuaranteed4'] = True
-            # 歪了，可能获得常驻光锥或常驻角色
-            # 假设角色和光锥概率均等
-            NUM_CHARS, NUM_LCS = 22, 29 # 引用星铁角色池的常驻数量
-            TOTAL_OFF_BANNER = NUM_CHARS + NUM_LCS
-
-            if r.get() < NUM_CHARS / TOTAL_OFF_BANNER: # 模拟抽到了角色
-                i = f"std_char_{int(r.get() * NUM_CHARS)}"
-                c[i] = c.get(i, 0) + 1
-                if c[i] == 1: return 0     # New: 0 星芒
-                elif c[i] <= 7: return 8 # 1-6魂: 8 星芒
-                else: return 20            # 满魂后: 20 星芒
-            else: # 模拟抽到了光锥
-                return 8
-
-MODEL_LOGIC = {
-    "genshin-character": GenshinCharacterLogic(),
-    "genshin-weapon": GenshinWeaponLogic(),
-    "hsr-character": HSRCharacterLogic(),
-    "hsr-lightcone": HSRLightConeLogic()
-}
+    def __init__(self, directory, max_bytes, max_entries=256):
+        self.directory, self.max_bytes, self.max_entries = directory, max_bytes, max_entries
+        self._memory = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, args):
+        """
+        规范化的 args 加上所涉及卡池 (多卡池组合为每一段的卡池) 的规格与 TABLE_CACHE_VERSION:
+        修改 POOL_SPECS 或转移链的构建方式后旧结果自动失效。不使用 _pool_fingerprint, 以免命中缓存时也要导入 NumPy 编译概率表。
+        """
+        canonical = self._canonical(args)
+        canonical.setdefault('mode', 'expectation')
+        if isinstance(args.get('legs'), list):
+            canonical['legs'] = [self._canonical(leg) if isinstance(leg, dict) else leg for leg in args['legs']]
+        pools = [args] + [leg for leg in canonical.get('legs', ()) if isinstance(leg, dict)]
+        canonical['_specs'] = [TABLE_CACHE_VERSION] + [POOL_SPECS.get(f"{a.get('game')}-{a.get('pool')}") for a in pools]
+        if args.get('jit'):
+            # 请求 JIT 内核时结果取决于是否安装了 Numba, 两种情况分开缓存 (只查找模块, 不导入)
+            import importlib.util
+            canonical['_jit'] = importlib.util.find_spec('numba') is not None
+        return hashlib.sha1(json.dumps(canonical, sort_keys=True).encode()).hexdigest()
+
+    def _canonical(self, args):
+        canonical = {k: v for k, v in args.items() if k not in self.IGNORED_ARGS and v is not None}
+        spec, state = POOL_SPECS.get(f"{args.get('game')}-{args.get('pool')}"), args.get('initialState')
+        if spec is not None and isinstance(state, dict):
+            # 等价的初始状态共用缓存 (如星铁卡池的明光计数、超过上限的命定值): 只保留 pity 与所在层
+            canonical['initialState'] = [int(state.get('pity', 0)), GachaLogic.layer_for(spec, state)]
+        return canonical
+
+    def get_or_compute(self, args, compute):
+        key = self.key(args)
+        text = self._get(key)
+        if text is None:
+            result = compute()
+            text = json.dumps(result)
+            if not result.get('cancelled'): self._put(key, text) # 被取消的请求只有部分样本, 不缓存
+        return json.loads(text)
+
+    def _path(self, key): return os.path.join(self.directory, f"{key}.json")
+
+    def _get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+        if not self.directory: return None
+        try:
+            with open(self._path(key), encoding='utf-8') as f: text = f.read()
+            os.utime(self._path(key))
+        except OSError:
+            return None
+        self._remember(key, text)
+        return text
+
+    def _remember(self, key, text):
+        with self._lock:
+            self._memory[key] = text
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries: self._memory.popitem(last=False)
+
+    def _put(self, key, text):
+        self._remember(key, text)
+        if not self.directory: return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{self._path(key)}.{os.getpid()}-{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f: f.write(text)
+            os.replace(tmp_path, self._path(key))
+            self._evict()
+        except OSError:
+            pass
+
+    def _evict(self):
+        entries = [e for e in os.scandir(self.directory) if e.name.endswith('.json')]
+        total = sum(e.stat().st_size for e in entries)
+        for entry in sorted(entries, key=lambda e: e.stat().st_mtime):
+            if total <= self.max_bytes: break
+            try:
+                total -= entry.stat().st_size
+                os.remove(entry.path)
+            except OSError: # 其他进程可能同时在淘汰
+                pass
+
+RESULT_CACHE = ResultCache(os.path.join(TABLE_CACHE_DIR, 'results') if TABLE_CACHE_DIR else None, RESULT_CACHE_MAX_BYTES)
+
+def run_request(args):
+    """计算一个请求, 结果经由 RESULT_CACHE 缓存; args['cache']=False 或启用 profile 时跳过缓存"""
+    if args.get('profile'): return _run_profiled(args)
+    if args.get('cache', True) is False: return _run_uncached(args)
+    return RESULT_CACHE.get_or_compute(args, lambda: _run_uncached(args))
+
+def _run_profiled(args):
+    """
+    在结果中附加 timings (import/tables/distribution/simulation/aggregation/serialization/total, 单位秒)
+    与 counters (模拟的总抽数、取用的随机数个数、随机数块补充次数)。给出 args['profileOutput'] 时
+    同时用 cProfile 记录当前线程并把 pstats 写入该路径。
+    """
+    _import_numpy() # 先导入 NumPy, 使其开销计入 import 而不是第一个用到它的阶段
+    profile, profiler = RequestProfile(), None
+    if args.get('profileOutput'):
+        import cProfile
+        profiler = cProfile.Profile()
+    started = time.perf_counter()
+    with profile.active():
+        if profiler: profiler.enable()
+        try:
+            result = _run_uncached(args)
+        finally:
+            if profiler: profiler.disable()
+    serialize_started = time.perf_counter()
+    json.dumps(result)
+    profile.timings['serialization'] = time.perf_counter() - serialize_started
+    if profiler: profiler.dump_stats(args['profileOutput'])
+    result['timings'] = {"import": IMPORT_SECONDS + NUMPY_IMPORT_SECONDS, **profile.timings, "total": time.perf_counter() - started}
+    result['counters'] = dict(profile.counters)
+    return result
+
+def _run_uncached(args):
+    if args.get('legs'): result = MultiBannerModel(args).run()
+    elif args.get('scenarios'): result = ScenarioModel(args).run()
+    else:
+        models = {'distribution': MonteCarloModel, 'exact': ExactDistributionModel, 'plan': PlannerModel}
+        result = models.get(args.get('mode', 'expectation'), MathematicalModel)(args).run()
+    stream = RequestStream.current()
+    if stream is not None and stream.interrupted: result['cancelled'] = True
+    return result
+
+@contextlib.contextmanager
+def _cancel_on_signals(cancel):
+    """在主线程中把 SIGTERM/SIGINT 转为调用 cancel(), 退出时恢复原来的处理函数; 其他线程中不做任何事"""
+    if threading.current_thread() is not threading.main_thread():
+        yield; return
+    import signal
+    previous = {sig: signal.signal(sig, lambda signum, frame: cancel()) for sig in (signal.SIGTERM, signal.SIGINT)}
+    try:
+        yield
+    finally:
+        for sig, handler in previous.items(): signal.signal(sig, handler)
+
+def run_streaming(args, stdout):
+    """
+    命令行的流式输出: args['stream'] 为真时每个模拟分块后输出一行 {"progress": 部分结果}, 最后一行为完整结果。
+    收到 SIGTERM/SIGINT 时取消请求, 用已完成的分块给出结果而不是直接退出; 再次收到时才中断。
+    """
+    def emit(partial):
+        stdout.write(json.dumps({"progress": partial}) + "\n"); stdout.flush()
+    def cancel():
+        if stream.cancelled.is_set(): raise KeyboardInterrupt
+        stream.cancelled.set()
+    stream = RequestStream(emit if args.get('stream') else None)
+    with _cancel_on_signals(cancel), stream.active():
+        return run_request(args)
+
+def precompute(modes=('expectation', 'distribution'), target_counts=(1, 2, 3), pity_step=10):
+    """预先计算最常见的查询 (各卡池 pity 每隔 pity_step 抽、大/小保底、1~3 个目标) 并写入结果缓存, 参数形式与 test2.js 发送的一致"""
+    for name, logic in MODEL_LOGIC.items():
+        game, pool = name.split('-')
+        for pity, guaranteed, count, mode in itertools.product(range(0, logic.PITY_MAX, pity_step), (False, True), target_counts, modes):
+            run_request({
+                "game": game, "pool": pool, "targetCount": count, "up4C6": False, "budget": None, "mode": mode,
+                "initialState": {"pity": pity, "isGuaranteed": guaranteed, "mingguangCounter": 0, "fatePoint": 0},
+            })
+
+def serve(stdin, stdout, max_workers=None):
+    """
+    常驻模式: 每行读入一个 JSON 请求 {"id": ..., "args": {...}}, 每个请求回复一行 {"id": ..., "result"/"error": ...}。
+    请求在线程池中并发处理, 回复顺序不保证与请求一致; MODEL_LOGIC 中已求解的表在请求之间复用。
+    args['stream'] 为真时每个模拟分块后先回复 {"id": ..., "progress": 部分结果}; 收到 {"id": ..., "cancel": true}
+    时该请求用已完成的分块给出结果。读到 EOF 后等待进行中的请求全部完成再返回, 收到 SIGTERM/SIGINT 时
+    取消所有进行中的请求并停止读入, 同样等它们回复后返回。
+    """
+    import traceback
+    from concurrent.futures import ThreadPoolExecutor
+    write_lock = threading.Lock()
+
+    def reply(message):
+        line = json.dumps(message)
+        with write_lock:
+            stdout.write(line + "\n"); stdout.flush()
+
+    streams, streams_lock = {}, threading.RLock() # 进行中的请求 id -> RequestStream; 信号处理函数也在主线程中加锁, 需可重入
+
+    def handle(request_id, args, stream):
+        try:
+            with stream.active():
+                reply({"id": request_id, "result": run_request(args)})
+        except Exception as e:
+            print(f"REQUEST {request_id} FAILED: {e}\n{traceback.format_exc()}", file=sys.stderr)
+            reply({"id": request_id, "error": str(e)})
+        finally:
+            with streams_lock:
+                if streams.get(request_id) is stream: del streams[request_id]
+
+    def shutdown():
+        with streams_lock:
+            for stream in streams.values(): stream.cancelled.set()
+        raise KeyboardInterrupt # 中断阻塞中的读入
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor, _cancel_on_signals(shutdown):
+        try:
+            for line in stdin:
+                if not line.strip(): continue
+                try:
+                    request = json.loads(line)
+                except ValueError as e:
+                    reply({"id": None, "error": f"invalid JSON: {e}"}); continue
+                if isinstance(request, dict) and request.get('cancel'):
+                    with streams_lock: stream = streams.get(request.get('id'))
+                    if stream is not None: stream.cancelled.set() # 已完成的请求忽略取消
+                    continue
+                if not isinstance(request, dict) or not isinstance(request.get('args'), dict):
+                    reply({"id": request.get('id') if isinstance(request, dict) else None, "error": "request must be an object with an 'args' object"}); continue
+                request_id, args = request.get('id'), request['args']
+                emit = (lambda partial, request_id=request_id: reply({"id": request_id, "progress": partial})) if args.get('stream') else None
+                stream = RequestStream(emit)
+                with streams_lock: streams[request_id] = stream
+                executor.submit(handle, request_id, args, stream)
+        except KeyboardInterrupt:
+            pass
 
 if __name__ == "__main__":
     try:
+        if sys.argv[1] == '--server':
+            serve(sys.stdin, sys.stdout)
+            sys.exit(0)
+        if sys.argv[1] == '--precompute':
+            # 可选第二个参数: 逗号分隔的模式列表, 如 expectation,distribution,exact
+            precompute(*(sys.argv[2].split(','),) if len(sys.argv) > 2 else ())
+            sys.exit(0)
+
         args = json.loads(sys.argv[1])
-        mode = args.get('mode', 'expectation')
-        
-        model = MonteCarloModel(args) if mode == 'distribution' else MathematicalModel(args)
-        
-        print(json.dumps(model.run()))
+        print(json.dumps(run_streaming(args, sys.stdout)))
         
     except Exception as e:
         import traceback
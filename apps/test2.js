@@ -1,5 +1,6 @@
 import { spawn } from 'child_process';
 import path from 'path';
+import readline from 'readline';
 import { fileURLToPath } from 'url';
 import os from 'os'; 
 
@@ -9,6 +10,95 @@ const VALID_POOLS = {
     'hsr': ['character', 'lightcone']
 };
 
+const __filename = fileURLToPath(import.meta.url);
+const __dirname = path.dirname(__filename);
+const pyScriptPath = path.join(__dirname, '..', 'apps', 'test.py');
+const pythonCommand = os.platform() === 'win32' ? 'python' : 'python3';
+// 模拟模式的时间上限: 超时后取消计算, 使用已完成的模拟结果
+const SIMULATION_TIMEOUT_MS = 60 * 1000;
+// 计算超过该时间仍未完成时, 向用户发送一次当前进度
+const PROGRESS_NOTICE_MS = 10 * 1000;
+
+/**
+ * 常驻的Python计算进程 (test.py --server)。
+ * 请求与回复均为一行JSON，通过 id 对应；进程退出后下次请求时自动重启。
+ * 带 stream 参数的请求在完成前会陆续收到 progress 回复；发送 cancel 后计算核心会用已完成的部分给出结果。
+ */
+const calcWorker = {
+    proc: null,
+    nextId: 1,
+    pending: new Map(),
+    stderrTail: '',
+
+    start() {
+        const proc = spawn(pythonCommand, [pyScriptPath, '--server']);
+        this.proc = proc;
+        this.stderrTail = '';
+
+        readline.createInterface({ input: proc.stdout }).on('line', (line) => {
+            let message;
+            try {
+                message = JSON.parse(line);
+            } catch {
+                logger.error(`[抽卡期望计算] 无法解析计算核心输出: ${line}`);
+                return;
+            }
+            const request = this.pending.get(message.id);
+            if (!request) return;
+            if (message.progress !== undefined) {
+                request.onProgress?.(message.progress);
+                return;
+            }
+            this.pending.delete(message.id);
+            clearTimeout(request.timer);
+            if (message.error !== undefined) {
+                request.reject(new Error(`错误：Python计算核心执行失败。\n请检查后台日志。\n错误日志: ${message.error}`));
+            } else {
+                request.resolve(message.result);
+            }
+        });
+        // 进程已退出时写入会触发 EPIPE，统一交由 close 事件处理
+        proc.stdin.on('error', () => {});
+        // 只保留最近的错误输出，用于进程异常退出时的提示
+        proc.stderr.on('data', (data) => { this.stderrTail = (this.stderrTail + data.toString()).slice(-2000); });
+
+        proc.on('error', (err) => {
+            this.failAll(proc, new Error(`错误：无法启动Python计算核心。\n请确认服务器已安装Python 3和numpy，并且 '${pythonCommand}' 命令在系统路径中可用。\n底层错误: ${err.message}`));
+        });
+        proc.on('close', (code) => {
+            this.failAll(proc, new Error(`错误：Python计算核心意外退出 (退出码: ${code})。\n请检查后台日志。\n错误日志: ${this.stderrTail || '无'}`));
+        });
+    },
+
+    failAll(proc, error) {
+        if (this.proc !== proc) return;
+        this.proc = null;
+        for (const request of this.pending.values()) {
+            clearTimeout(request.timer);
+            request.reject(error);
+        }
+        this.pending.clear();
+    },
+
+    /**
+     * 发送一个计算请求
+     * @param {object} args - 计算参数
+     * @param {object} [options] - onProgress: 收到部分结果时的回调 (同时开启 stream); timeoutMs: 超时后取消计算
+     */
+    request(args, { onProgress, timeoutMs } = {}) {
+        if (!this.proc) this.start();
+        const id = this.nextId++;
+        const proc = this.proc;
+        return new Promise((resolve, reject) => {
+            const timer = timeoutMs ? setTimeout(() => {
+                if (this.proc === proc) proc.stdin.write(JSON.stringify({ id, cancel: true }) + '\n');
+            }, timeoutMs) : undefined;
+            this.pending.set(id, { resolve, reject, onProgress, timer });
+            proc.stdin.write(JSON.stringify({ id, args: onProgress ? { ...args, stream: true } : args }) + '\n');
+        });
+    }
+};
+
 export class gachaCalc extends plugin {
     constructor() {
         super({
@@ -20,6 +110,8 @@ export class gachaCalc extends plugin {
                 { reg: '^#期望计算帮助$', fnc: 'showHelp' },
                 { reg: '^#期望计算(.*)$', fnc: 'calculateExpectation' },
                 { reg: '^#期望分布(.*)$', fnc: 'calculateDistribution' },
+                { reg: '^#期望规划(.*)$', fnc: 'calculatePlan' },
+                { reg: '^#期望组合(.*)$', fnc: 'calculateCombination' },
             ],
         });
     }
@@ -34,13 +126,48 @@ export class gachaCalc extends plugin {
         await this.handleRequest(e, 'distribution');
     }
 
+    // 指令入口: #期望规划 (给定预算, 求一定把握下最多能获得几个)
+    async calculatePlan(e) {
+        await this.handleRequest(e, 'plan');
+    }
+
+    /**
+     * 指令入口: #期望组合 (多个卡池依次抽取, 各段以 + 分隔, 共用一个预算)
+     * 例如 "原神 角色 2个 + 武器 1把 预算400抽", 未写游戏的段沿用前一段的游戏
+     */
+    async calculateCombination(e) {
+        const rawParams = e.msg.replace('#期望组合', '').trim();
+        const legs = rawParams.split(/[+＋]/).map(part => this.parseArgs(part));
+        if (!rawParams || legs.length === 0) {
+            await this.reply(`请输入参数。发送 #期望计算帮助 查看详情。`);
+            return true;
+        }
+        legs.forEach((leg, i) => { if (!leg.game && i > 0) leg.game = legs[i - 1].game; });
+        if (legs.some(leg => !leg.game || !leg.pool || !VALID_POOLS[leg.game]?.includes(leg.pool))) {
+            await this.reply(`错误：每一段都需要指定有效的游戏与卡池，例如 原神 角色 2个 + 武器 1把。`);
+            return true;
+        }
+        const budget = legs.map(leg => leg.budget).find(b => b !== null) ?? null;
+
+        await this.reply(`正在光速计算中，请稍候... (模式: combination)`);
+        try {
+            const args = { legs: legs.map(({ game, pool, initialState, targetCount }) => ({ game, pool, initialState, targetCount })), budget };
+            const resultData = await calcWorker.request(args);
+            await this.reply(this.generateCombinationReport(legs, budget, resultData), true);
+        } catch (error) {
+            logger.error(`[抽卡期望计算] 外部脚本执行失败: ${error.message}`);
+            await this.reply(error.message, true);
+        }
+        return true;
+    }
+
     /**
      * 统一处理所有请求的核心函数
      * @param {object} e - Yunzai的事件对象
-     * @param {string} mode - 'expectation' (数学模式) 或 'distribution' (模拟模式)
+     * @param {string} mode - 'expectation' (数学模式), 'distribution' (模拟模式) 或 'plan' (预算规划)
      */
     async handleRequest(e, mode) {
-        const command = mode === 'distribution' ? '#期望分布' : '#期望计算';
+        const command = { distribution: '#期望分布', plan: '#期望规划' }[mode] || '#期望计算';
         const rawParams = e.msg.replace(command, '').trim();
         
         if (!rawParams) {
@@ -59,13 +186,16 @@ export class gachaCalc extends plugin {
             await this.reply(`错误：【${gameName}】中没有【${poolName}】卡池，请检查输入。`);
             return true;
         }
+        if (mode === 'plan' && args.budget === null) {
+            await this.reply(`错误：#期望规划 需要指定预算，例如 预算300抽。`);
+            return true;
+        }
 
         await this.reply(`正在光速计算中，请稍候... (模式: ${mode})`);
         args.mode = mode;
 
         try {
-            const resultJson = await this.runPythonCalculator(args);
-            const resultData = JSON.parse(resultJson);
+            const resultData = await calcWorker.request(args, mode === 'distribution' ? this.progressOptions() : {});
             const report = this.generateReport(args, resultData);
             await this.reply(report, true);
         } catch (error) {
@@ -76,43 +206,21 @@ export class gachaCalc extends plugin {
     }
 
     /**
-     * 调用外部Python脚本的函数
-     * @param {object} args - 包含所有计算参数的对象
-     * @returns {Promise<string>} 返回一个包含JSON结果字符串的Promise
+     * 模拟请求的进度与超时设置: 计算超过 PROGRESS_NOTICE_MS 后发送一次当前进度, 超过 SIMULATION_TIMEOUT_MS 后取消
      */
-    runPythonCalculator(args) {
-        const __filename = fileURLToPath(import.meta.url);
-        const __dirname = path.dirname(__filename);
-        const pluginRoot = path.join(__dirname, '..');
-        const pyScriptPath = path.join(pluginRoot, 'apps', 'test.py');
-        const pythonCommand = os.platform() === 'win32' ? 'python' : 'python3';
-
-        return new Promise((resolve, reject) => {
-            const argsJson = JSON.stringify(args);
-            // 动态确定命令
-            const pyProcess = spawn(pythonCommand, [pyScriptPath, argsJson]);
-
-            let result = '';
-            let errorMessage = '';
-
-            pyProcess.stdout.on('data', (data) => { result += data.toString(); });
-            pyProcess.stderr.on('data', (data) => { errorMessage += data.toString(); });
-
-            pyProcess.on('error', (err) => {
-                // 优化了错误提示
-                reject(new Error(`错误：无法启动Python计算核心。\n请确认服务器已安装Python 3和numpy，并且 '${pythonCommand}' 命令在系统路径中可用。\n底层错误: ${err.message}`));
-            });
-
-            pyProcess.on('close', (code) => {
-                if (code === 0) {
-                    resolve(result);
-                } else {
-                    reject(new Error(`错误：Python计算核心执行失败 (退出码: ${code})。\n请检查后台日志。\n错误日志: ${errorMessage || '无'}`));
-                }
-            });
-        });
+    progressOptions() {
+        const started = Date.now();
+        let noticed = false;
+        return {
+            timeoutMs: SIMULATION_TIMEOUT_MS,
+            onProgress: (partial) => {
+                if (noticed || Date.now() - started < PROGRESS_NOTICE_MS) return;
+                noticed = true;
+                this.reply(`计算中... 已完成 ${partial.samples} 次模拟, 当前中位线 ${partial.pulls.p50} 抽`);
+            }
+        };
     }
-    
+
     /**
      * 生成最终发送给用户的报告
      * @param {object} args - 用户输入的参数
@@ -123,18 +231,37 @@ export class gachaCalc extends plugin {
         const poolName = { 'character': 'UP角色', 'weapon': '定轨武器', 'lightcone': 'UP光锥' }[args.pool];
         const unit = { 'character': '个', 'weapon': '把', 'lightcone': '个' }[args.pool];
         
+        // 规划模式由预算反推目标数, 不显示输入的 targetCount
+        const targetLine = args.mode === 'plan' ? '' : `目标：获取 ${args.targetCount}${unit}\n`;
         let report = `--- 抽卡期望与分布 ---
 游戏：${gameName} | 卡池：${poolName}
-目标：获取 ${args.targetCount}${unit}
-
+${targetLine}
 【初始状态】
 ${this.formatInitialState(args)}
 `;
+        if (args.mode === 'plan') {
+            report += `
+【预算规划】
+使用 ${data.budget} 抽, 有 ${data.confidence}% 的把握至少获得 ${data.max_targets}${unit}
+`;
+            report += data.table.filter(row => row.success_rate >= 0.5)
+                .map(row => `• ${row.targetCount}${unit}: ${row.success_rate.toFixed(2)}%`).join('\n');
+            return report;
+        }
+
         const pullsData = data.pulls || { mean: data.mean };
         report += `
 【抽数分析】
 期望抽数 (平均值): ${pullsData.mean.toFixed(2)} 抽
 `;
+        if (data.std !== undefined) {
+            report += `标准差: ${data.std.toFixed(2)} 抽 (偏度 ${data.skewness.toFixed(2)})
+`;
+        }
+        if (data.cancelled) {
+            report += `(计算超时, 以下为已完成的 ${data.samples} 次模拟的结果)
+`;
+        }
         if (args.mode === 'distribution') {
             report += `• 欧皇线 (25%): ${pullsData.p25} 抽内
 • 中位线 (50%): ${pullsData.p50} 抽内
@@ -169,6 +296,36 @@ ${this.formatInitialState(args)}
         return report;
     }
     
+    /**
+     * 生成多卡池组合的报告
+     * @param {object[]} legs - 各段参数
+     * @param {number|null} budget - 共用预算
+     * @param {object} data - Python脚本返回的数据
+     */
+    generateCombinationReport(legs, budget, data) {
+        const gameName = { 'genshin': '原神', 'hsr': '星铁' };
+        const poolName = { 'character': 'UP角色', 'weapon': '定轨武器', 'lightcone': 'UP光锥' };
+        const unit = { 'character': '个', 'weapon': '把', 'lightcone': '个' };
+        let report = `--- 多卡池组合规划 ---\n`;
+        report += legs.map((leg, i) => `${i + 1}. ${gameName[leg.game]} ${poolName[leg.pool]} ${leg.targetCount}${unit[leg.pool]} (垫${leg.initialState.pity}抽): 平均 ${data.legs[i].pulls.mean.toFixed(2)} 抽`).join('\n');
+        const pulls = data.pulls;
+        report += `
+
+【合计抽数】
+期望抽数 (平均值): ${pulls.mean.toFixed(2)} 抽
+• 欧皇线 (25%): ${pulls.p25} 抽内
+• 中位线 (50%): ${pulls.p50} 抽内
+• 非酋线 (75%): ${pulls.p75} 抽内
+• 天选非酋 (95%): ${pulls.p95} 抽内`;
+        if (data.success_rate !== undefined) {
+            report += `
+
+【预算达成概率】
+使用 ${budget} 抽, 全部达成的概率为: ${data.success_rate.toFixed(2)}%`;
+        }
+        return report;
+    }
+
     /**
      * 格式化初始状态部分的文本
      * @param {object} args - 用户输入的参数
@@ -212,8 +369,11 @@ ${this.formatInitialState(args)}
             else if (['小保底', '不歪'].includes(token)) args.initialState.isGuaranteed = false;
             
             const budgetMatch = token.match(/^(预算|持有|目标)(\d+)(抽|发)?$/);
+            const confidenceMatch = token.match(/^(置信|把握)?(\d+(?:\.\d+)?)%$/) || token.match(/^(置信|把握)(\d+(?:\.\d+)?)$/);
             if (budgetMatch) {
                 args.budget = parseInt(budgetMatch[2]);
+            } else if (confidenceMatch) {
+                args.confidence = parseFloat(confidenceMatch[2]);
             } else {
                 const countMatch = token.match(/^(\d+)(个|把|张|命|魂|精)$/);
                 if (countMatch) args.targetCount = parseInt(countMatch[1]);
@@ -240,6 +400,8 @@ ${this.formatInitialState(args)}
 指令:
   #期望计算 [参数...]  (快速获取平均值)
   #期望分布 [参数...]  (获取详细概率分布)
+  #期望规划 [参数...]  (给定预算, 求有把握获得的最多数量)
+  #期望组合 [参数...] + [参数...]  (多个卡池依次抽取, 共用预算)
 
 参数 (顺序随意):
  • 游戏: 原神, 星铁
@@ -251,10 +413,13 @@ ${this.formatInitialState(args)}
  • 明光: 明光2 (原神角色池专用)(计算方法：自上次小保底不歪开始连续歪了几次)
  • 定轨: 定轨1 (原神武器池专用)
  • 四星满命: (分布模式, 角色池专用)
+ • 置信度: 置信90 或 90% (规划模式专用, 默认80%)
 
 示例:
  • #期望计算 原神 角色 3个
  • #期望分布 星铁 角色 1个 四星满命 预算150抽
+ • #期望规划 原神 角色 预算300抽 置信90
+ • #期望组合 原神 角色 2个 + 武器 1把 预算400抽
 `;
         this.reply(helpMessage);
         return true;
@@ -0,0 +1,192 @@
+"""
+模拟引擎与精确解的统计一致性检查: 对每个卡池比较模拟的均值、p50/p90 与预算成功率和吸收链给出的精确值,
+偏差超过 MAX_Z 个标准误即失败。种子固定, 结果可复现。
+"""
+import os
+import functools
+import sys
+
+import numpy as np
+import pytest
+
+os.environ['GACHA_CACHE_DIR'] = '' # 不读写磁盘上的表缓存
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import test as gacha # noqa: E402  apps/test.py
+
+MAX_Z = 5.0
+TARGET_COUNT = 2
+# 每个卡池一个默认起点和一个带额外计数 (明光/命定值) 或大保底、已垫抽数的起点
+START_STATES = {
+    "genshin-character": [{"pity": 0, "isGuaranteed": False, "mingguangCounter": 0}, {"pity": 30, "isGuaranteed": False, "mingguangCounter": 2}],
+    "genshin-weapon": [{"pity": 0, "isGuaranteed": False, "fatePoint": 0}, {"pity": 50, "isGuaranteed": True, "fatePoint": 1}],
+    "hsr-character": [{"pity": 0, "isGuaranteed": False}, {"pity": 40, "isGuaranteed": True}],
+    "hsr-lightcone": [{"pity": 0, "isGuaranteed": False}, {"pity": 60, "isGuaranteed": False}],
+}
+CASES = [(pool, state) for pool, states in START_STATES.items() for state in states]
+
+def _args(pool, state, **extra):
+    game, pool_name = pool.split('-')
+    return dict({"game": game, "pool": pool_name, "initialState": dict(state), "targetCount": TARGET_COUNT,
+                 "up4C6": False, "seed": 20240601, "cache": False}, **extra)
+
+def assert_matches_exact(pulls, pool, state):
+    """pulls 为各次模拟的总抽数; 与精确 PMF 比较均值、p50/p90 与中位数处的预算成功率"""
+    pmf = gacha.MODEL_LOGIC[pool].get_pull_distribution(dict(state), TARGET_COUNT)
+    cdf = np.cumsum(pmf); values = np.arange(len(pmf))
+    n = len(pulls)
+    mean = float(values @ pmf); sd = float(np.sqrt(values ** 2 @ pmf - mean ** 2))
+    assert abs(pulls.mean() - mean) <= MAX_Z * sd / np.sqrt(n), f"{pool} {state}: mean {pulls.mean():.3f} vs exact {mean:.3f}"
+
+    for q in (0.5, 0.9):
+        # 模拟分位数处的精确累计概率应落在 q 附近 (阶梯状 CDF 允许跨过一个台阶)
+        p_q = int(np.percentile(pulls, q * 100, method='inverted_cdf'))
+        tolerance = MAX_Z * np.sqrt(q * (1 - q) / n)
+        assert cdf[p_q] >= q - tolerance and (p_q == 0 or cdf[p_q - 1] <= q + tolerance), f"{pool} {state}: p{q * 100:.0f}={p_q}"
+
+    budget = int(np.searchsorted(cdf, 0.5))
+    rate = float(np.mean(pulls <= budget)); exact_rate = float(cdf[budget])
+    assert abs(rate - exact_rate) <= MAX_Z * np.sqrt(exact_rate * (1 - exact_rate) / n) + 1e-12, f"{pool} {state}: rate {rate} vs {exact_rate}"
+
+def _histogram_samples(hist):
+    return np.repeat(np.arange(len(hist.counts)), hist.counts)
+
+@pytest.mark.parametrize("pool,state", CASES)
+def test_vectorized_engine_matches_exact(pool, state):
+    mc = gacha.MonteCarloModel(_args(pool, state))
+    mc.simulation_count = 40_000
+    aggregate, _ = mc.simulate()
+    assert_matches_exact(_histogram_samples(aggregate.pulls[-1]), pool, state)
+
+@pytest.mark.parametrize("pool,state", CASES)
+def test_vectorized_result_matches_exact_result(pool, state):
+    # 经由 run_request 的完整结果: 均值与成功率和精确模式一致
+    exact = gacha.run_request(_args(pool, state, mode='exact', budget=150))
+    simulated = gacha.run_request(_args(pool, state, mode='distribution', budget=150))
+    n = simulated['samples']; p = exact['success_rate'] / 100
+    assert abs(simulated['success_rate'] - exact['success_rate']) <= MAX_Z * np.sqrt(p * (1 - p) / n) * 100 + 1e-9
+    pmf = np.array(exact['pmf']); values = np.arange(len(pmf))
+    sd = float(np.sqrt(values ** 2 @ pmf - exact['pulls']['mean'] ** 2))
+    assert abs(simulated['pulls']['mean'] - exact['pulls']['mean']) <= MAX_Z * sd / np.sqrt(n)
+
+SCALAR_RUNS = 4000 # 逐次模拟较慢, 样本数少一些, 允许的偏差按标准误相应放宽
+
+def _kernel_samples(kernel, pool, state):
+    gacha._import_numpy() # 未编译的内核按全局变量使用 np
+    pulls, _, draws = gacha.MODEL_LOGIC[pool].simulate_full_runs(kernel, SCALAR_RUNS, _args(pool, state), 12345)
+    assert draws >= pulls[:, -1].sum() # 每抽至少取用一个随机数
+    return pulls[:, -1]
+
+@pytest.mark.parametrize("pool,state", CASES)
+def test_scalar_python_engine_matches_exact(pool, state):
+    mc = gacha.MonteCarloModel(_args(pool, state, engine='scalar', jit=False))
+    mc.simulation_count = SCALAR_RUNS
+    aggregate, _ = mc.simulate()
+    assert_matches_exact(_histogram_samples(aggregate.pulls[-1]), pool, state)
+
+@pytest.mark.parametrize("pool,state", CASES)
+def test_uncompiled_kernel_matches_exact(pool, state):
+    assert_matches_exact(_kernel_samples(gacha._full_runs_kernel, pool, state), pool, state)
+
+@pytest.mark.parametrize("pool,state", CASES)
+def test_jit_kernel_matches_exact(pool, state):
+    pytest.importorskip('numba')
+    assert_matches_exact(_kernel_samples(gacha._jit_kernel(), pool, state), pool, state)
+
+@pytest.mark.parametrize("pool", list(START_STATES))
+def test_scalar_paths_agree_with_expectation_mode(pool):
+    # 两条逐次模拟路径的均值都应与解析期望一致
+    state = START_STATES[pool][1]
+    analytic = gacha.MathematicalModel(_args(pool, state)).run()
+    bound = MAX_Z * analytic['std'] / np.sqrt(SCALAR_RUNS)
+    assert abs(_kernel_samples(gacha._full_runs_kernel, pool, state).mean() - analytic['mean']) <= bound
+    mc = gacha.MonteCarloModel(_args(pool, state, engine='scalar', jit=False, seed=777))
+    mc.simulation_count = SCALAR_RUNS
+    assert abs(mc.simulate()[0].pulls[-1].mean() - analytic['mean']) <= bound
+
+@pytest.mark.parametrize("mode", ['expectation', 'exact', 'distribution'])
+@pytest.mark.parametrize("target_count", [0, -2])
+def test_non_positive_target_count_needs_no_pulls(mode, target_count):
+    result = gacha.run_request(_args("genshin-character", START_STATES["genshin-character"][0], mode=mode, targetCount=target_count, budget=10))
+    assert result.get('mean', result.get('pulls', {}).get('mean')) == 0.0
+    if mode != 'expectation': assert result['success_rate'] == 100.0
+
+@pytest.mark.parametrize("extra,count", [({}, 25_000), ({"adaptive": True, "budget": 120}, None), ({"engine": "scalar", "jit": False}, 12_000)])
+def test_seeded_simulation_does_not_depend_on_workers(extra, count):
+    # 第 i 个分块总是使用 SeedSequence(seed) 派生的第 i 个随机流, 并行时多算的分块按顺序丢弃
+    args = dict(_args("genshin-character", START_STATES["genshin-character"][1], mode='distribution', seed=99), **extra)
+    def run(workers):
+        mc = gacha.MonteCarloModel(dict(args, workers=workers))
+        if count: mc.simulation_count = count # 最后一个分块不满
+        return mc.run()
+    single = run(1)
+    assert run(2) == single and run(3) == single
+
+@pytest.mark.parametrize("pool", list(START_STATES))
+def test_scenarios_curve_matches_rate_and_modes_agree(pool):
+    scenarios = [{"targetCount": 0, "budget": 5}, {"targetCount": 1, "budget": 60}, {"targetCount": 3, "budget": 250}, {"targetCount": 2}]
+    args = _args(pool, START_STATES[pool][1], scenarios=scenarios)
+    exact = gacha.run_request(dict(args, mode='exact'))['scenarios']
+    simulated = gacha.run_request(dict(args, mode='distribution'))
+    for scenario, e, s in zip(scenarios, exact, simulated['scenarios']):
+        for answer in (e, s):
+            if 'budget' not in scenario: assert 'success_rate' not in answer; continue
+            curve = answer['success_curve']
+            assert curve[min(scenario['budget'], len(curve) - 1)] == pytest.approx(answer['success_rate'], abs=1e-9)
+        if 'budget' in scenario:
+            p = e['success_rate'] / 100
+            assert abs(s['success_rate'] - e['success_rate']) <= MAX_Z * np.sqrt(p * (1 - p) / simulated['samples']) * 100 + 1e-9
+        pmf = gacha.MODEL_LOGIC[pool].get_pull_distribution(args['initialState'], scenario['targetCount'])
+        sd = float(np.sqrt(np.arange(len(pmf)) ** 2 @ pmf - e['pulls']['mean'] ** 2))
+        assert abs(s['pulls']['mean'] - e['pulls']['mean']) <= MAX_Z * sd / np.sqrt(simulated['samples']) + 1e-9
+
+MOMENT_STATES = [{"pity": 0}, {"pity": 45, "isGuaranteed": True}, {"pity": 20, "mingguangCounter": 2},
+                 {"pity": 70, "mingguangCounter": 3}, {"pity": 10, "fatePoint": 1}]
+
+@pytest.mark.parametrize("pool", list(START_STATES))
+@pytest.mark.parametrize("state", MOMENT_STATES)
+@pytest.mark.parametrize("target_count", [1, 3, 7])
+def test_expectation_moments_match_exact_distribution(pool, state, target_count):
+    state = dict({"isGuaranteed": False, "mingguangCounter": 0, "fatePoint": 0}, **state)
+    result = gacha.MathematicalModel(_args(pool, state, targetCount=target_count)).run()
+    pmf = gacha.MODEL_LOGIC[pool].get_pull_distribution(dict(state), target_count, tail=1e-15)
+    values = np.arange(len(pmf)); mean = float(values @ pmf)
+    variance = float((values - mean) ** 2 @ pmf)
+    skewness = float((values - mean) ** 3 @ pmf) / variance ** 1.5
+    assert result['mean'] == pytest.approx(mean, rel=1e-9)
+    assert result['variance'] == pytest.approx(variance, rel=1e-8)
+    assert result['std'] == pytest.approx(np.sqrt(variance), rel=1e-8)
+    assert result['skewness'] == pytest.approx(skewness, abs=1e-7)
+
+@pytest.mark.parametrize("pool,state", CASES)
+@pytest.mark.parametrize("budget", [0, 150, 400])
+def test_planner_table_matches_exact_cdf(pool, state, budget):
+    result = gacha.run_request(_args(pool, state, mode='plan', budget=budget, confidence=75))
+    assert result['table'][0]['targetCount'] == 1
+    for row in result['table']:
+        cdf = np.cumsum(gacha.MODEL_LOGIC[pool].get_pull_distribution(dict(state), row['targetCount'], tail=1e-15))
+        assert row['success_rate'] == pytest.approx(float(cdf[min(budget, len(cdf) - 1)]) * 100, abs=1e-8)
+    reached = [row['targetCount'] for row in result['table'] if row['success_rate'] >= 75]
+    assert result['max_targets'] == max(reached, default=0)
+    assert result['table'][-1]['success_rate'] < gacha.PlannerModel.MIN_REPORTED_RATE # 表格延续到达成概率可以忽略为止
+
+LEG_PLANS = [
+    [("genshin-character", 1), ("genshin-weapon", 1)], # 两段且较短: 直接卷积
+    [("hsr-character", 1), ("hsr-lightcone", 1), ("hsr-character", 2)], # 超过两段: FFT
+    [("genshin-character", 7), ("hsr-character", 7)], # 两段但合计长度超过 FFT_MIN_SIZE: FFT
+]
+
+@pytest.mark.parametrize("plan", LEG_PLANS)
+def test_multi_banner_convolution_matches_direct_chain(plan):
+    legs = [_args(pool, START_STATES[pool][1], targetCount=k) for pool, k in plan]
+    pmfs = [gacha.MODEL_LOGIC[f"{leg['game']}-{leg['pool']}"].get_pull_distribution(leg['initialState'], k) for leg, (_, k) in zip(legs, plan)]
+    direct = functools.reduce(np.convolve, pmfs)
+    combined = gacha.MultiBannerModel.convolve(pmfs)
+    assert len(combined) == len(direct) and np.abs(combined - direct).max() < 1e-14
+    assert combined.min() >= 0.0
+
+    budget = int(np.searchsorted(np.cumsum(direct), 0.5))
+    result = gacha.run_request({"legs": legs, "budget": budget, "cache": False})
+    cdf = np.cumsum(direct)
+    assert result['success_rate'] == pytest.approx(float(cdf[budget]) * 100, abs=1e-10)
+    assert result['success_curve'][budget] == pytest.approx(result['success_rate'], abs=1e-12)
+    assert result['pulls']['mean'] == pytest.approx(sum(leg['pulls']['mean'] for leg in result['legs']), rel=1e-12)
@@ -0,0 +1,107 @@
+"""
+常驻模式的 JSON 行协议 (serve / run_streaming) 与请求结果缓存 (ResultCache) 的检查。
+"""
+import io
+import os
+import sys
+import json
+
+os.environ['GACHA_CACHE_DIR'] = '' # 不读写磁盘上的表缓存
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import test as gacha # noqa: E402  apps/test.py
+
+STATE = {"pity": 0, "isGuaranteed": False, "mingguangCounter": 0, "fatePoint": 0}
+
+def _args(**extra):
+    return dict({"game": "genshin", "pool": "character", "initialState": dict(STATE), "targetCount": 1, "up4C6": False, "cache": False}, **extra)
+
+def _serve(*lines):
+    """把 lines (对象先序列化为 JSON) 作为标准输入运行 serve, 读到 EOF 后返回解析后的各行回复"""
+    stdin = io.StringIO("".join((line if isinstance(line, str) else json.dumps(line)) + "\n" for line in lines))
+    out = io.StringIO()
+    gacha.serve(stdin, out, max_workers=2)
+    return [json.loads(line) for line in out.getvalue().splitlines()]
+
+def test_serve_tags_replies_with_request_ids():
+    replies = _serve({"id": "a", "args": _args()}, "", {"id": 7, "args": _args(targetCount=2)})
+    by_id = {r['id']: r for r in replies}
+    assert set(by_id) == {"a", 7} and len(replies) == 2
+    assert by_id["a"]["result"] == gacha.run_request(_args())
+    assert by_id[7]["result"] == gacha.run_request(_args(targetCount=2))
+
+def test_serve_reports_malformed_requests_and_keeps_going():
+    replies = _serve("{not json", "[1, 2]", {"id": 3}, {"id": 4, "args": _args(pool="nopool")}, {"id": 5, "args": _args()})
+    errors = [r for r in replies if 'error' in r]
+    assert [r['id'] for r in errors] == [None, None, 3, 4]
+    assert errors[0]['error'].startswith("invalid JSON")
+    assert "'args' object" in errors[1]['error'] and "'args' object" in errors[2]['error']
+    assert [r['id'] for r in replies if 'result' in r] == [5] # 出错的请求不影响之后的请求, 读到 EOF 后正常返回
+
+def test_serve_streams_progress_and_cancels():
+    # 收敛要求为 0 的自适应模拟只会在取消 (或达到 maxSimulations 安全上限) 时结束
+    streamed = _args(mode='distribution', seed=3, adaptive=True, tolerance=0, rateTolerance=0, budget=100,
+                     maxSimulations=500_000, stream=True)
+    replies = _serve({"id": 1, "args": streamed}, {"id": 1, "cancel": True}, {"id": 99, "cancel": True},
+                     {"id": 2, "args": _args(mode='distribution', seed=3, stream=True)})
+    for request_id in (1, 2):
+        mine = [r for r in replies if r['id'] == request_id]
+        progress, final = [r['progress'] for r in mine[:-1]], mine[-1]
+        assert progress and all('progress' in r for r in mine[:-1]) and 'result' in final # 进度行都在最终回复之前
+        assert [p['samples'] for p in progress] == sorted(p['samples'] for p in progress)
+        assert progress[-1] == {k: v for k, v in final['result'].items() if k != 'cancelled'} # 最终结果即最后一次进度
+    results = {r['id']: r['result'] for r in replies if 'result' in r}
+    assert results[1]['cancelled'] is True and results[1]['samples'] < 500_000
+    assert 'cancelled' not in results[2] and results[2]['samples'] == 50_000
+    assert not any(r['id'] == 99 for r in replies) # 取消未知 (已完成) 的请求不产生回复
+
+def test_run_streaming_writes_progress_lines_before_returning():
+    out = io.StringIO()
+    result = gacha.run_streaming(_args(mode='distribution', seed=5, stream=True), out)
+    progress = [json.loads(line)['progress'] for line in out.getvalue().splitlines()]
+    assert [p['samples'] for p in progress] == [10_000, 20_000, 30_000, 40_000, 50_000]
+    assert progress[-1] == result and 'cancelled' not in result
+    assert gacha.run_streaming(_args(mode='distribution', seed=5), io.StringIO()) == result # 不带 stream 时结果相同且不输出进度
+
+def test_cache_key_merges_equivalent_initial_states():
+    cache = gacha.ResultCache(None, 0)
+    hsr = dict(_args(game="hsr"), initialState={"pity": 12, "isGuaranteed": True})
+    # 星铁卡池没有明光计数, 该字段不影响结果; 原神角色池则应区分
+    assert cache.key(hsr) == cache.key(dict(hsr, initialState=dict(hsr['initialState'], mingguangCounter=2)))
+    assert cache.key(_args()) != cache.key(_args(initialState=dict(STATE, mingguangCounter=2)))
+
+def test_cache_key_ignores_workers_and_stream():
+    cache = gacha.ResultCache(None, 0)
+    base = _args(mode='distribution', seed=1)
+    assert cache.key(base) == cache.key(dict(base, workers=4)) == cache.key(dict(base, stream=True)) == cache.key(dict(base, cache=True))
+    assert cache.key(base) != cache.key(dict(base, seed=2))
+
+def test_cache_key_changes_with_pool_spec(monkeypatch):
+    cache = gacha.ResultCache(None, 0)
+    legs = {"legs": [_args(), _args(pool="weapon")], "budget": 300}
+    before, legs_before = cache.key(_args()), cache.key(legs)
+    monkeypatch.setitem(gacha.POOL_SPECS, "genshin-weapon", dict(gacha.POOL_SPECS["genshin-weapon"], winRate=0.9))
+    assert cache.key(_args()) == before # 只影响用到该卡池的请求
+    assert cache.key(legs) != legs_before
+    monkeypatch.setitem(gacha.POOL_SPECS, "genshin-character", dict(gacha.POOL_SPECS["genshin-character"], winRate=0.9))
+    assert cache.key(_args()) != before
+
+def test_cancelled_results_are_not_cached(tmp_path):
+    cache, calls = gacha.ResultCache(str(tmp_path), 2**20), []
+    def compute():
+        calls.append(1)
+        return {"samples": 10_000, "cancelled": True}
+    assert cache.get_or_compute(_args(), compute)['cancelled'] is True
+    cache.get_or_compute(_args(), compute)
+    assert len(calls) == 2 and not list(tmp_path.iterdir())
+    cache.get_or_compute(_args(), lambda: {"samples": 50_000})
+    assert cache.get_or_compute(_args(), compute) == {"samples": 50_000} and len(calls) == 2
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    cache = gacha.ResultCache(str(tmp_path), max_bytes=250)
+    text = json.dumps({"pad": "x" * 80}) # 每个文件约 90 字节, 最多保留两个
+    cache._put("a", text); cache._put("b", text)
+    os.utime(cache._path("a"), (1_000, 1_000)); os.utime(cache._path("b"), (2_000, 2_000))
+    # 新的缓存实例 (内存层为空) 读取 a 时刷新其修改时间, 因此写入 c 后被淘汰的是 b
+    assert gacha.ResultCache(str(tmp_path), max_bytes=250)._get("a") == text
+    cache._put("c", text)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["a.json", "c.json"]